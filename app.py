@@ -1,21 +1,68 @@
+import bisect
+import builtins
+import json
 import os, sys
 sys.path.append(os.path.dirname(os.path.realpath(__file__)))
 
-from flask import Flask, abort, redirect, render_template, request, url_for, jsonify
+from flask import Flask, abort, g, make_response, redirect, render_template, request, url_for, jsonify
 from flask_cors import CORS
 from functools import wraps
 from werkzeug.utils import redirect
+import time
 import uuid
 
+# Imported by its top level name, like spiel does, so both share one registry.
+import metrics
+
+from .deck_snapshot import DEFAULT_RELOAD_INTERVAL
+from .http_cache import ResponseCache, DEFAULT_CACHE_BYTES, compress
+from .sessions import SessionStore, DEFAULT_MAX_SESSIONS, DEFAULT_SESSION_TTL
+from .lookup_index import DEFAULT_SUGGESTIONS
+from .search_index import DEFAULT_RESULTS
 from .spiel import DeutschesSpiel
 # from .translation_compiler import Compiler
 
-spiel = DeutschesSpiel(use_semantic=False, use_multimode=True)
+# With SPIEL_SHARED_DECK=1 the deck is mapped from shared memory (or
+# SPIEL_SHARED_DECK_DIR), so pre-forked workers do not each hold a copy.
+# With SPIEL_SCORING_WORKERS=<n> answers are scored in n worker processes
+# rather than in the request greenlets.
+spiel = DeutschesSpiel(
+    use_semantic=os.environ.get("SPIEL_SEMANTIC") == "1", use_multimode=True,
+    shared_deck=os.environ.get("SPIEL_SHARED_DECK") == "1",
+    shared_deck_dir=os.environ.get("SPIEL_SHARED_DECK_DIR"),
+    scoring_workers=int(os.environ.get("SPIEL_SCORING_WORKERS", 0)))
+if os.environ.get("SPIEL_SHARED_DECK") == "1":
+    spiel.prepare_for_fork()
+
+MAX_SUGGESTIONS = 50
+MAX_SEARCH_RESULTS = 200
+
+DEFAULT_BATCH_SIZE = 10
+MAX_BATCH_SIZE = 50
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+REQUEST_DURATION = metrics.Histogram(
+    "spiel_http_request_duration_seconds", "Time taken to answer requests, by route.",
+    labels=["method", "route", "status"])
+SESSIONS = metrics.Gauge("spiel_sessions", "Learners with a question cursor.")
+
+LEARNER_COOKIE_NAME = "spiel_learner"
+LEARNER_COOKIE_MAX_AGE = 365 * 24 * 60 * 60  # seconds
 
 # Generate a unique session ID when the server starts
 def _generate_session_id():
     return str(uuid.uuid4())
 
+def _with_prefix(words, prefix):
+    # words is sorted, so the words starting with prefix are contiguous.
+    start = bisect.bisect_left(words, prefix)
+    end = start
+    while end < len(words) and words[end].startswith(prefix):
+        end += 1
+    return words[start:end]
+
 def create_app():
     app = Flask(__name__)
     
@@ -24,9 +71,61 @@ def create_app():
     app.config.from_mapping(
         DEEPL_KEY = os.environ.get("DEEPL_KEY"),
         SPIEL_MODE = os.environ.get("SPIEL_MODE"),
-        SESSION_ID = _generate_session_id()
+        SESSION_ID = _generate_session_id(),
+        MAX_SESSIONS = int(os.environ.get("SPIEL_MAX_SESSIONS", DEFAULT_MAX_SESSIONS)),
+        SESSION_TTL = int(os.environ.get("SPIEL_SESSION_TTL", DEFAULT_SESSION_TTL)),
+        RESPONSE_CACHE_BYTES = int(os.environ.get("SPIEL_RESPONSE_CACHE_BYTES", DEFAULT_CACHE_BYTES)),
+        RELOAD_INTERVAL = float(os.environ.get("SPIEL_RELOAD_INTERVAL", DEFAULT_RELOAD_INTERVAL)),
+        MAX_BLOCKING_TIME = float(os.environ.get("SPIEL_MAX_BLOCKING_TIME", metrics.DEFAULT_MAX_BLOCKING_TIME)),
+        PUBLIC_METRICS = os.environ.get("SPIEL_PUBLIC_METRICS") == "1"
     )
 
+    # Every request shares one gevent hub, so a single blocking call stalls
+    # them all; watch for it. A maximum blocking time of 0 turns this off.
+    if app.config["MAX_BLOCKING_TIME"] > 0:
+        metrics.start_loop_monitor(max_blocking_time=app.config["MAX_BLOCKING_TIME"])
+
+    # Pick up new words without a restart, which would drop every session.
+    # An interval of 0 turns reloading off.
+    if app.config["RELOAD_INTERVAL"] > 0:
+        spiel.watch_deck(app.config["RELOAD_INTERVAL"])
+
+    # Every learner walks the shared deck with their own question cursor.
+    sessions = SessionStore(
+        spiel.new_cursor,
+        max_sessions=app.config["MAX_SESSIONS"],
+        ttl=app.config["SESSION_TTL"])
+
+    SESSIONS.set_function(lambda: len(sessions))
+
+    # Rendered /lookup and /search responses, valid for as long as the deck.
+    response_cache = ResponseCache(max_bytes=app.config["RESPONSE_CACHE_BYTES"])
+
+    @app.before_request
+    def start_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def record_duration(response):
+        if "request_start" in g:
+            # Label by route pattern rather than path, so that every word
+            # looked up does not make a series of its own.
+            route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+            REQUEST_DURATION.observe(
+                time.perf_counter() - g.request_start,
+                method=request.method, route=route, status=response.status_code)
+        return response
+
+    @app.route("/metrics")
+    def metrics_page():
+        # Only served to the machine itself unless made public.
+        if not app.config["PUBLIC_METRICS"] and request.remote_addr not in ("127.0.0.1", "::1"):
+            abort(403)
+        response = make_response(metrics.REGISTRY.render(), 200)
+        response.mimetype = "text/plain"
+        response.headers["Content-Type"] = "text/plain; version=0.0.4; charset=utf-8"
+        return response
+
     def is_prod_mode():
         mode = app.config["SPIEL_MODE"]
         return mode is not None and mode == "PROD"
@@ -45,6 +144,22 @@ def create_app():
             return f(*args, **kwargs)
         return decorated_function  
 
+    def get_learner_id():
+        return request.cookies.get(LEARNER_COOKIE_NAME) or str(uuid.uuid4())
+
+    def learner_cursor():
+        # The cursor of the learner sending the request, if they have one.
+        # Routes that do not set the learner cookie must not create cursors,
+        # or every cookieless request would push a learner out of the store.
+        return sessions.peek(request.cookies.get(LEARNER_COOKIE_NAME))
+
+    def with_learner_cookie(response, learner_id):
+        if request.cookies.get(LEARNER_COOKIE_NAME) != learner_id:
+            response.set_cookie(
+                LEARNER_COOKIE_NAME, learner_id,
+                max_age=LEARNER_COOKIE_MAX_AGE, samesite="Lax")
+        return response
+
     @app.route("/")
     def index():
         return render_template(
@@ -85,7 +200,8 @@ def create_app():
         #     })})
         
         data = {'session_id': app.config["SESSION_ID"]}
-        return jsonify(data), 200
+        return with_learner_cookie(
+            make_response(jsonify(data), 200), get_learner_id())
 
     @app.route("/play")
     def play():
@@ -94,72 +210,214 @@ def create_app():
     @app.route("/next_question")
     @dec_validate_session_id
     def next_question():
-        query_param = request.args.get('order')
-        try:
-            if query_param is not None and query_param == "serial":
-                start_param = request.args.get('start')
-                question_type_param = request.args.get('question_type')
-                next_entry = spiel.get_next_entry(serial=True, start=start_param, mode=question_type_param)
-            else:
-                next_entry = spiel.get_next_entry(serial=False)
-        except Exception as e:
-            abort(400, description=f"Error: {e}")            
-        
-        next_question = next_entry["value"]
-        next_question["mode"] = next_entry["mode"]
+        learner_id = get_learner_id()
+        cursor = sessions.get(learner_id)
+
+        next_question = next_questions_from(cursor, 1)[0]
         
         start = False
         query_param = request.args.get('mode')
         if query_param is not None:
             if query_param == "json":                
                 data = {'next_question': next_question}
-                return jsonify(data), 200
+                return with_learner_cookie(
+                    make_response(jsonify(data), 200), learner_id)
             elif query_param == "start":
                 start = True
             else:
                 abort(400, description=f"Invalid query parameter value: {query_param}")
 
-        return render_template(
+        return with_learner_cookie(make_response(render_template(
             "question.html",
             start=start,
             entry=next_question,
-            session_id=app.config["SESSION_ID"])
+            session_id=app.config["SESSION_ID"])), learner_id)
       
+    def next_questions_from(cursor, n):
+        # The next n questions of the cursor in the order asked for by the
+        # request. A start key and a forced question type only decide the
+        # first one, the question the client asked for; the rest of a serial
+        # batch goes on with the usual multimode choice.
+        query_param = request.args.get('order')
+        start_param = request.args.get('start')
+        question_type_param = request.args.get('question_type')
+        
+        ret = []
+        try:
+            for i in range(n):
+                if query_param is not None and query_param == "serial":
+                    if i == 0:
+                        next_entry = spiel.get_next_entry(
+                            serial=True, start=start_param,
+                            mode=question_type_param, cursor=cursor)
+                    else:
+                        next_entry = spiel.get_next_entry(serial=True, cursor=cursor)
+                elif query_param is not None and query_param == "due":
+                    next_entry = spiel.get_next_entry(mode="due", cursor=cursor)
+                else:
+                    next_entry = spiel.get_next_entry(serial=False, cursor=cursor)
+                
+                # Copy so that the shared deck entry is not modified.
+                next_question = dict(next_entry["value"])
+                next_question["mode"] = next_entry["mode"]
+                ret.append(next_question)
+        except Exception as e:
+            abort(400, description=f"Error: {e}")
+        return ret
+
+    @app.route("/next_questions")
+    @dec_validate_session_id
+    def next_questions():
+        # A batch of upcoming questions for the client to ask one after the
+        # other without coming back to the server.
+        learner_id = get_learner_id()
+        cursor = sessions.get(learner_id)
+
+        n = min(max(request.args.get('n', DEFAULT_BATCH_SIZE, type=int), 1), MAX_BATCH_SIZE)
+        data = {'next_questions': next_questions_from(cursor, n)}
+        # Different for every request, so compressed but not cached.
+        return with_learner_cookie(
+            compress(request, make_response(jsonify(data), 200)), learner_id)
+
+    def cached(key, render):
+        # Serves a response from the response cache, keyed by key and the deck
+        # version. render() returns anything a view may return.
+        def render_body():
+            response = make_response(render())
+            headers = [(k, v) for k, v in response.headers
+                       if k.lower() not in ("content-type", "content-length")]
+            return response.get_data(), response.status_code, response.mimetype, headers
+        return response_cache.respond(request, key + (spiel.deck_version(),), render_body)
+
     @app.route("/lookup")
     def lookup():
         query_param = request.args.get('wort')
-        result = None
-        if query_param:
-            result = spiel.lookup(query_param)
-
-        is_json = request.args.get('mode') == "json"
-        if is_json:
-            if result is None:
-                return jsonify({'examples': []}), 200            
-            
-            data = {'examples': result['examples']}
-            return jsonify(data), 200
-        else:
-            return render_template(
-                "lookup.html",
-                word=query_param,
-                entry=result)
+        mode = request.args.get('mode')
+
+        if mode == "suggest":
+            # Ranked completions and near misses for autocomplete.
+            limit = min(max(request.args.get('limit', DEFAULT_SUGGESTIONS, type=int), 1), MAX_SUGGESTIONS)
+
+            def render_suggestions():
+                suggestions = []
+                if query_param:
+                    suggestions = spiel.suggest(query_param, limit=limit)
+                return jsonify({'suggestions': suggestions}), 200
+            return cached(("lookup", query_param, mode, limit), render_suggestions)
+
+        def render():
+            result = None
+            if query_param:
+                result = spiel.lookup(query_param)
+
+            is_json = mode == "json"
+            if is_json:
+                if result is None:
+                    return jsonify({'examples': []}), 200
+
+                data = {'examples': result['examples']}
+                return jsonify(data), 200
+            else:
+                suggestions = []
+                if result is None and query_param:
+                    suggestions = spiel.suggest(query_param)
+                return render_template(
+                    "lookup.html",
+                    word=query_param,
+                    entry=result,
+                    suggestions=suggestions)
+        return cached(("lookup", query_param, mode == "json"), render)
+
+    @app.route("/search")
+    def search():
+        query_param = request.args.get('q')
+        limit = min(max(request.args.get('limit', DEFAULT_RESULTS, type=int), 1), MAX_SEARCH_RESULTS)
+
+        def render():
+            results = []
+            if query_param:
+                results = spiel.search(query_param, limit=limit)
+            return jsonify({'results': results}), 200
+        return cached(("search", query_param, limit), render)
 
     @app.route("/list")
     def list():
-        word_list = spiel.list()
-        word_list = [word.capitalize() for word in word_list]
-        return jsonify(sorted(word_list)), 200
+        prefix = request.args.get('prefix', '')
+        offset = max(request.args.get('offset', 0, type=int), 0)
+        limit = request.args.get('limit', type=int)
+        page = request.args.get('page', type=int)
+        if page is not None:
+            limit = limit or DEFAULT_PAGE_SIZE
+            offset = max(page - 1, 0) * limit
+        if limit is not None:
+            limit = min(max(limit, 1), MAX_PAGE_SIZE)
+
+        # The list only changes with the deck, so every page of it is
+        # serialized and compressed once per deck, and a client that already
+        # holds it gets a 304.
+        def render():
+            words = spiel.sorted_word_list()
+            if prefix:
+                words = _with_prefix(words, prefix.capitalize())
+            end = None if limit is None else offset + limit
+            body = json.dumps(words[offset:end], ensure_ascii=False)
+            return body, 200, {"Content-Type": "application/json",
+                               "X-Total-Count": str(len(words))}
+        return cached(("list", prefix, offset, limit), render)
      
     @app.route("/answer_score")
     def answer_score():
         user_answer = request.args.get('answer')
         translation = request.args.get('translation')
+        if user_answer is None or translation is None:
+            abort(400, description="Error: answer and translation are required")
+        word = request.args.get('word')
+        if word and not get_spiel().is_word(word):
+            abort(400, description=f"Error: unknown word {word}")
+
         (score_string, score) = get_spiel().get_answer_score(
             user_answer, translation)
+
+        # Answers to word questions also reschedule the word for the "due"
+        # order, for the learner's cursor if they already have one.
+        if word:
+            get_spiel().record_score(word, score, cursor=learner_cursor())
+
         data = {'score_string': score_string, 'score': score}
         return jsonify(data), 200
 
+    @app.route("/answer_scores", methods=['POST'])
+    def answer_scores():
+        # {"answers": [{"answer": <>, "translation": <>, "word": <optional>}]}
+        data = request.get_json(silent=True)
+        answers = data.get("answers") if isinstance(data, dict) else None
+        # list is the /list view in here.
+        if not isinstance(answers, builtins.list) or len(answers) > MAX_BATCH_SIZE:
+            abort(400, description=f"Error: expected a list of at most {MAX_BATCH_SIZE} answers")
+        for a in answers:
+            if not (isinstance(a, dict) and isinstance(a.get("answer"), str) and
+                    isinstance(a.get("translation"), str) and
+                    isinstance(a.get("word", ""), (str, type(None)))):
+                abort(400, description=f"Error: invalid answer {a}")
+        pairs = [(a["answer"], a["translation"]) for a in answers]
+
+        unknown = [a["word"] for a in answers
+                   if a.get("word") and not get_spiel().is_word(a["word"])]
+        if unknown:
+            abort(400, description=f"Error: unknown words {unknown}")
+
+        scores = get_spiel().get_answer_scores(pairs)
+
+        cursor = learner_cursor()
+        for a, (_, score) in zip(answers, scores):
+            if a.get("word"):
+                get_spiel().record_score(a["word"], score, cursor=cursor)
+
+        data = {'scores': [
+            {'score_string': score_string, 'score': score}
+            for (score_string, score) in scores]}
+        return jsonify(data), 200
+
     @app.route("/exit")
     def exit():
         # get_spiel().exit_game()
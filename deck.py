@@ -0,0 +1,295 @@
+from collections.abc import Mapping, Sequence
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+
+from log import get_logger
+
+logger = get_logger()
+
+DECK_FILE_NAME = "_deck.bin"
+
+SHARED_DECK_PREFIX = "spiel_deck_"
+
+'''
+Compiled deck layout (all integers little endian, offsets from file start):
+
+    header     magic, format version, entry count, key count, SHA-1 of the
+               JSON dump it was compiled from and the section offsets
+    entries    one fixed-width row per entry: offset and length of its word,
+               of its JSON record without examples and of its examples JSON
+    keys       one fixed-width row per lowercased word, sorted by UTF-8
+               bytes: offset and length of the key and the entry it maps to
+    strings    words, keys and records
+    examples   examples of every entry as JSON
+
+Everything is read through a read-only mmap, so only the rows of the entries
+actually asked for are ever paged in and decoded, and processes mapping the
+same file share its pages.
+'''
+_MAGIC = b"SPDK"
+_FORMAT_VERSION = 1
+_HEADER = struct.Struct("<4sHHII20sQQQQ")
+_ENTRY = struct.Struct("<QIQIQI")
+_KEY = struct.Struct("<QII")
+
+class Deck(Sequence):
+    def __init__(self, file_name):
+        self._file = open(file_name, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, format_version, _, self._count, self._key_count, source_hash,
+         self._entries_off, self._keys_off, _, _) = _HEADER.unpack_from(self._mm, 0)
+        if magic != _MAGIC or format_version != _FORMAT_VERSION:
+            raise ValueError(f"{file_name} is not a compiled deck of version {_FORMAT_VERSION}")
+
+        self.version = source_hash.hex()
+        self.positions = DeckPositions(self)
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, idx):
+        word_off, word_len, record_off, record_len, examples_off, examples_len = \
+            self._row(idx)
+        entry = json.loads(self._mm[record_off:record_off + record_len])
+        entry["examples"] = json.loads(self._mm[examples_off:examples_off + examples_len])
+        return entry
+
+    def word(self, idx):
+        word_off, word_len = self._row(idx)[:2]
+        return self._mm[word_off:word_off + word_len].decode()
+
+    def examples(self, idx):
+        examples_off, examples_len = self._row(idx)[4:]
+        return json.loads(self._mm[examples_off:examples_off + examples_len])
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+    def _row(self, idx):
+        if idx < 0:
+            idx += self._count
+        if not 0 <= idx < self._count:
+            raise IndexError("deck index out of range")
+        return _ENTRY.unpack_from(self._mm, self._entries_off + idx * _ENTRY.size)
+
+    def _key(self, i):
+        key_off, key_len, idx = _KEY.unpack_from(self._mm, self._keys_off + i * _KEY.size)
+        return self._mm[key_off:key_off + key_len], idx
+
+class DeckPositions(Mapping):
+    '''
+    {<lowercased word>: <index>} view of a compiled deck, answered by a binary
+    search over its sorted key table.
+    '''
+    def __init__(self, deck):
+        self._deck = deck
+
+    def __getitem__(self, word):
+        target = word.encode()
+        lo, hi = 0, self._deck._key_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            key, idx = self._deck._key(mid)
+            if key < target:
+                lo = mid + 1
+            elif key > target:
+                hi = mid
+            else:
+                return idx
+        raise KeyError(word)
+
+    def __iter__(self):
+        for i in range(self._deck._key_count):
+            yield self._deck._key(i)[0].decode()
+
+    def __len__(self):
+        return self._deck._key_count
+
+class JsonDeck(Sequence):
+    '''
+    The same interface as Deck over entries loaded from the JSON dump, used
+    while no up to date compiled deck is available.
+    '''
+    def __init__(self, file_name):
+        with open(file_name, 'rb') as file:
+            contents = file.read()
+
+        self.version = hashlib.sha1(contents).hexdigest()
+        self._rows = json.loads(contents)
+        self.positions = {}
+        for idx, entry in enumerate(self._rows):
+            self.positions[entry["word"].lower()] = idx
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __getitem__(self, idx):
+        return self._rows[idx]
+
+    def word(self, idx):
+        return self._rows[idx]["word"]
+
+    def examples(self, idx):
+        return self._rows[idx]["examples"]
+
+    def close(self):
+        pass
+
+def load_deck(dump_file_name, deck_file_name=DECK_FILE_NAME):
+    # Prefer the compiled deck unless the dump has been changed after it was
+    # compiled.
+    if os.path.exists(deck_file_name) and (
+            not os.path.exists(dump_file_name) or
+            os.path.getmtime(deck_file_name) >= os.path.getmtime(dump_file_name)):
+        logger.debug(f"Loading entries from compiled deck {deck_file_name}.")
+        return Deck(deck_file_name)
+
+    logger.debug(f"Loading entries from dump file {dump_file_name}.")
+    return JsonDeck(dump_file_name)
+
+def default_shared_dir():
+    # tmpfs where there is one, so the deck lives in shared memory rather
+    # than on disk.
+    if os.path.isdir("/dev/shm"):
+        return "/dev/shm"
+    return tempfile.gettempdir()
+
+def load_shared_deck(dump_file_name, shared_dir=None, deck_file_name=DECK_FILE_NAME):
+    '''
+    Maps the deck compiled from dump_file_name out of shared_dir, compiling it
+    there first unless a process has already done so. The file is named after
+    the dump's content, so every process serving the same dump maps the same
+    pages, whether it loaded the deck itself or inherited the mapping from a
+    parent it was forked from. Decks of older dumps are removed; processes
+    still mapping them keep their pages until they let go.
+
+    A compiled deck_file_name of the same dump, or of whatever dump it was
+    compiled from when there is no dump, is copied rather than compiled again.
+    '''
+    if shared_dir is None:
+        shared_dir = default_shared_dir()
+
+    compiled_digest = None
+    if os.path.exists(deck_file_name):
+        compiled_digest = _source_digest(deck_file_name)
+
+    if os.path.exists(dump_file_name):
+        with open(dump_file_name, 'rb') as file:
+            digest = hashlib.sha1(file.read()).hexdigest()
+    elif compiled_digest is not None:
+        digest = compiled_digest
+    else:
+        raise FileNotFoundError(f"Neither {dump_file_name} nor {deck_file_name} found")
+
+    shared_file_name = os.path.join(shared_dir, SHARED_DECK_PREFIX + digest + ".bin")
+    if not os.path.exists(shared_file_name):
+        if digest == compiled_digest:
+            tmp_file_name = f"{shared_file_name}.{os.getpid()}.tmp"
+            shutil.copyfile(deck_file_name, tmp_file_name)
+            os.replace(tmp_file_name, shared_file_name)
+        else:
+            compile_deck(dump_file_name, shared_file_name)
+
+        for file_name in os.listdir(shared_dir):
+            path = os.path.join(shared_dir, file_name)
+            if (file_name.startswith(SHARED_DECK_PREFIX) and file_name.endswith(".bin")
+                    and path != shared_file_name):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    logger.debug(f"Loading entries from shared deck {shared_file_name}.")
+    return Deck(shared_file_name)
+
+def _source_digest(deck_file_name):
+    # SHA-1 of the dump a compiled deck was compiled from, or None if the
+    # file is not a compiled deck of this version.
+    with open(deck_file_name, 'rb') as file:
+        header = file.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        return None
+    magic, format_version, _, _, _, source_hash, _, _, _, _ = _HEADER.unpack(header)
+    if magic != _MAGIC or format_version != _FORMAT_VERSION:
+        return None
+    return source_hash.hex()
+
+def compile_deck(dump_file_name, deck_file_name=DECK_FILE_NAME):
+    with open(dump_file_name, 'rb') as file:
+        contents = file.read()
+    rows = json.loads(contents)
+
+    strings = bytearray()
+    examples = bytearray()
+
+    def add_string(value):
+        off = len(strings)
+        strings.extend(value)
+        return off, len(value)
+
+    entry_rows = []
+    keys = {}
+    for idx, entry in enumerate(rows):
+        word = entry["word"].encode()
+        record = {k: v for k, v in entry.items() if k != "examples"}
+        record = json.dumps(record, ensure_ascii=False).encode()
+        entry_examples = json.dumps(entry.get("examples", []), ensure_ascii=False).encode()
+
+        word_off, word_len = add_string(word)
+        record_off, record_len = add_string(record)
+        examples_off = len(examples)
+        examples.extend(entry_examples)
+        entry_rows.append(
+            (word_off, word_len, record_off, record_len, examples_off, len(entry_examples)))
+
+        # Later entries win, as they do when the dump is loaded into a dict.
+        keys[entry["word"].lower().encode()] = idx
+
+    key_rows = []
+    for key in sorted(keys):
+        key_off, key_len = add_string(key)
+        key_rows.append((key_off, key_len, keys[key]))
+
+    entries_off = _HEADER.size
+    keys_off = entries_off + len(entry_rows) * _ENTRY.size
+    strings_off = keys_off + len(key_rows) * _KEY.size
+    examples_off = strings_off + len(strings)
+
+    out = bytearray(_HEADER.pack(
+        _MAGIC, _FORMAT_VERSION, 0, len(entry_rows), len(key_rows),
+        hashlib.sha1(contents).digest(),
+        entries_off, keys_off, strings_off, examples_off))
+    for word_off, word_len, record_off, record_len, eg_off, eg_len in entry_rows:
+        out += _ENTRY.pack(
+            strings_off + word_off, word_len, strings_off + record_off, record_len,
+            examples_off + eg_off, eg_len)
+    for key_off, key_len, idx in key_rows:
+        out += _KEY.pack(strings_off + key_off, key_len, idx)
+    out += strings
+    out += examples
+
+    # Replace the file in one go, so that anyone still mapping the old deck
+    # keeps reading a complete file.
+    tmp_file_name = f"{deck_file_name}.{os.getpid()}.tmp"
+    with open(tmp_file_name, 'wb') as file:
+        file.write(out)
+    os.replace(tmp_file_name, deck_file_name)
+
+    logger.info(f"Compiled {len(entry_rows)} entries from {dump_file_name} into {deck_file_name}.")
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compile the JSON dump into a memory-mappable deck")
+    parser.add_argument('dump', nargs='?', default="_dump.txt", help='JSON dump to read')
+    parser.add_argument('deck', nargs='?', default=DECK_FILE_NAME, help='Compiled deck to write')
+
+    args = parser.parse_args()
+    compile_deck(args.dump, args.deck)
@@ -0,0 +1,169 @@
+import json
+import os
+import threading
+import time
+
+import gevent
+
+from deck import load_deck, load_shared_deck, DECK_FILE_NAME
+from log import get_logger
+from lookup_index import LookupIndex
+from search_index import SearchIndex
+
+logger = get_logger()
+
+DEFAULT_RELOAD_INTERVAL = 5.0  # seconds
+
+class DeckSnapshot:
+    '''
+    Everything read from the dump and the prepositions file, plus the indexes
+    built over them. A snapshot is never changed once loaded; reloading the
+    files builds a new one, so whoever holds a snapshot keeps reading one
+    consistent version of the deck.
+    '''
+    def __init__(self, rows, prepositions):
+        self.rows = rows  # Deck of {"word":<word>, "de_to_en":<>, "translation":<>,...}
+        self.word_positions = rows.positions  # {<word>: <index in rows>}
+        self.version = rows.version
+
+        self.prepositions = prepositions
+        self.preposition_positions = {}  # {<verb>: <index in prepositions>}
+        for idx, entry in enumerate(prepositions):
+            self.preposition_positions[entry["verb"].lower()] = idx
+
+        # Built on first use so that loading does not depend on deck size.
+        self._lookup_index = None
+        self._search_index = None
+        self._word_list = None
+
+    @classmethod
+    def load(cls, dump_file_name, prepositions_file_name, deck_file_name=DECK_FILE_NAME,
+             shared=False, shared_dir=None):
+        # Shared decks always come from a compiled deck in shared_dir (see
+        # load_shared_deck), never from a per-process parse of the dump.
+        if shared:
+            rows = load_shared_deck(dump_file_name, shared_dir, deck_file_name)
+        else:
+            rows = load_deck(dump_file_name, deck_file_name)
+        with open(prepositions_file_name, 'r') as file:
+            prepositions = json.load(file)
+        return cls(rows, prepositions)
+
+    @property
+    def lookup_index(self):
+        if self._lookup_index is None:
+            self._lookup_index = LookupIndex(
+                self.rows.word(idx) for idx in range(len(self.rows)))
+        return self._lookup_index
+
+    @property
+    def search_index(self):
+        if self._search_index is None:
+            self._search_index = SearchIndex(self.rows)
+        return self._search_index
+
+    @property
+    def word_list(self):
+        # Capitalized and sorted; shared, so callers must not modify it.
+        if self._word_list is None:
+            self._word_list = sorted(word.capitalize() for word in self.word_positions)
+        return self._word_list
+
+    def warm(self):
+        self.lookup_index
+        self.search_index
+        self.word_list
+
+    def warm_like(self, other):
+        # Builds the indexes that other has already built, so that swapping
+        # this snapshot in does not make the next requests pay for them.
+        if other._lookup_index is not None:
+            self.lookup_index
+        if other._search_index is not None:
+            self.search_index
+        if other._word_list is not None:
+            self.word_list
+
+class DeckWatcher:
+    '''
+    Polls the files a snapshot is loaded from and calls on_change with a new
+    snapshot once they have changed and then stayed unchanged for one more
+    poll, so that files still being written are not picked up halfway.
+    A snapshot that fails to load is logged and retried on the next change.
+
+    load, and prepare if given, run in a thread of the gevent hub's
+    threadpool, so that parsing the files and building indexes does not hold
+    up the greenlets on the hub; whatever prepare returns for the new
+    snapshot is passed on to on_change, which is called back on the hub.
+    '''
+    def __init__(self, load, file_names, on_change, interval=DEFAULT_RELOAD_INTERVAL,
+                 prepare=None):
+        self._load = load
+        self._file_names = file_names
+        self._on_change = on_change
+        self._interval = interval
+        self._prepare = prepare
+
+        self._loaded = self._signature()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="deck-watcher", daemon=True)
+        self._thread.start()
+
+        # Threads do not survive a fork, so a server forking its workers off
+        # an already loaded app has every worker watch for itself.
+        os.register_at_fork(after_in_child=self._restart_in_child)
+
+    def _restart_in_child(self):
+        if not self._stopped.is_set():
+            self._stopped = threading.Event()
+            self._thread = threading.Thread(target=self._run, name="deck-watcher", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def check(self, previous=None):
+        # Reloads if the files have changed since the last load and look the
+        # same as in previous. Returns the signature seen.
+        signature = self._signature()
+        if signature != self._loaded and signature == previous:
+            started = time.monotonic()
+            try:
+                snapshot, prepared = gevent.get_hub().threadpool.apply(self._load_prepared)
+            except Exception as e:
+                logger.warning(f"Could not reload deck: {e}")
+            else:
+                if self._prepare is not None:
+                    self._on_change(snapshot, prepared)
+                else:
+                    self._on_change(snapshot)
+                logger.info(
+                    f"Reloaded deck {snapshot.version} with {len(snapshot.rows)} entries "
+                    f"in {time.monotonic() - started:.2f}s.")
+            self._loaded = signature
+        return signature
+
+    def _load_prepared(self):
+        snapshot = self._load()
+        prepared = self._prepare(snapshot) if self._prepare is not None else None
+        return snapshot, prepared
+
+    def _run(self):
+        previous = None
+        while not self._stopped.wait(self._interval):
+            previous = self.check(previous)
+
+    def _signature(self):
+        signature = []
+        for file_name in self._file_names:
+            try:
+                stat = os.stat(file_name)
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
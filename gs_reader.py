@@ -1,4 +1,3 @@
-import gspread
 import traceback
 
 from log import get_logger
@@ -12,6 +11,8 @@ class FileReadError(Exception):
         self.original_exception = original_exception
 
 def fetch_from_gsheet(spreadsheet, sheet):
+    import gspread
+
     try:
         logger.debug(f"Reading Google Spreadsheet file {spreadsheet},{sheet}")
         
@@ -0,0 +1,157 @@
+import gzip
+import hashlib
+import time
+
+from flask import make_response
+
+from log import get_logger
+import metrics
+from util import LRUCache
+
+logger = get_logger()
+
+DEFAULT_CACHE_BYTES = 16 * 1024 * 1024
+MIN_COMPRESS_SIZE = 512
+
+CACHE_REQUESTS = metrics.Counter(
+    "spiel_response_cache_requests_total", "Response cache lookups, by result.",
+    labels=["result"])
+CACHE_BYTES = metrics.Gauge(
+    "spiel_response_cache_bytes", "Bytes held by the response cache.")
+
+class CachedResponse:
+    def __init__(self, body, status, mimetype, headers=()):
+        self.body = body
+        self.status = status
+        self.mimetype = mimetype
+        self.headers = headers
+        self.etag = hashlib.sha1(body).hexdigest()
+        self.last_modified = int(time.time())
+
+        # {<content coding>: <body in that coding>}, best coding first.
+        self.encodings = {}
+        if len(body) >= MIN_COMPRESS_SIZE:
+            for coding, compress in _compressors().items():
+                self.encodings[coding] = compress(body)
+
+    @property
+    def weight(self):
+        return len(self.body) + sum(len(b) for b in self.encodings.values())
+
+class ResponseCache:
+    '''
+    Keeps rendered responses, in memory bounded by max_bytes, so that routes
+    whose output only depends on their arguments and the deck can skip
+    rendering altogether. Each body is compressed once when it is stored and
+    served in whichever coding the client accepts, and clients that already
+    hold it get a 304.
+
+    Keys must include the deck version, so that a new deck never serves stale
+    entries; old ones simply age out.
+    '''
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self._entries = LRUCache(max_bytes, weigh=lambda entry: entry.weight)
+        CACHE_BYTES.set_function(self._entries.weight)
+
+    '''
+    Returns the response for key, calling render() on a miss. render returns
+    a (body, status, mimetype, headers) tuple, headers being (name, value)
+    pairs to send along; bodies of responses other than 200 are passed
+    through but not stored.
+    '''
+    def respond(self, request, key, render):
+        entry = self._entries.get(key)
+        if entry is None:
+            CACHE_REQUESTS.inc(result="miss")
+            body, status, mimetype, headers = render()
+            if isinstance(body, str):
+                body = body.encode()
+            entry = CachedResponse(body, status, mimetype, headers)
+            if status == 200:
+                self._entries.put(key, entry)
+        else:
+            CACHE_REQUESTS.inc(result="hit")
+
+        return _to_response(request, entry)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+def compress(request, response):
+    '''
+    Compresses a response that is not worth caching, like one rendered for a
+    single learner, in whichever coding the client accepts.
+    '''
+    response.vary.add("Accept-Encoding")
+    if (response.status_code != 200 or response.direct_passthrough or
+            "Content-Encoding" in response.headers):
+        return response
+    body = response.get_data()
+    if len(body) < MIN_COMPRESS_SIZE:
+        return response
+    compressors = _compressors()
+    coding = _negotiate(request, compressors)
+    if coding is not None:
+        response.set_data(compressors[coding](body))
+        response.headers["Content-Encoding"] = coding
+    return response
+
+def _to_response(request, entry):
+    # Every coding is a representation of its own and gets an ETag of its
+    # own, so that caches never hand out one coding for another.
+    coding = _negotiate(request, entry.encodings)
+    etag = entry.etag if coding is None else f"{entry.etag}-{coding}"
+
+    if entry.status == 200 and (
+            request.if_none_match.contains(etag) or
+            (not request.if_none_match and request.if_modified_since is not None and
+             request.if_modified_since.timestamp() >= entry.last_modified)):
+        response = make_response("", 304)
+    else:
+        body = entry.body
+        if coding is not None:
+            body = entry.encodings[coding]
+        response = make_response(body, entry.status)
+        response.mimetype = entry.mimetype
+        if coding is not None:
+            response.headers["Content-Encoding"] = coding
+
+    for name, value in entry.headers:
+        response.headers[name] = value
+    if entry.status == 200:
+        response.set_etag(etag)
+        response.last_modified = entry.last_modified
+        response.headers["Cache-Control"] = "public, no-cache"
+    response.vary.add("Accept-Encoding")
+    return response
+
+def _negotiate(request, encodings):
+    for coding in encodings:
+        if request.accept_encodings[coding] > 0:
+            return coding
+    return None
+
+def _compressors():
+    # {<content coding>: <compress function>}, best coding first.
+    compressors = {}
+    brotli = _brotli()
+    if brotli is not None:
+        compressors["br"] = lambda body: brotli.compress(body, quality=5)
+    compressors["gzip"] = lambda body: gzip.compress(body, compresslevel=6)
+    return compressors
+
+_brotli_module = None
+
+def _brotli():
+    # Brotli is optional; without it responses are only offered gzipped.
+    global _brotli_module
+    if _brotli_module is None:
+        try:
+            import brotli
+            _brotli_module = brotli
+        except ImportError:
+            _brotli_module = False
+    return _brotli_module or None
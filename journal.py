@@ -0,0 +1,215 @@
+import glob
+import json
+import os
+import re
+import time
+
+import gevent
+
+from log import get_logger
+
+logger = get_logger()
+
+JOURNAL_FILE_PREFIX = "_scores_journal"
+SNAPSHOT_FILE_NAME = "_scores_snapshot.txt"
+
+FSYNC_EVERY = 32          # records
+FSYNC_INTERVAL = 1.0      # seconds
+COMPACT_EVERY = 10000     # records
+
+class ScoreJournal:
+    '''
+    Append-only log of score records with periodic compaction into a snapshot.
+
+    Every record is written to the current journal segment as one JSON line
+    and handed to the OS straight away, so a killed process loses nothing;
+    fsync, which only matters for power loss, is batched and runs in a
+    thread of the gevent hub's threadpool, so that appending never waits
+    for the disk and no greenlet is held up while it syncs. Compaction writes
+    the caller's full state to the snapshot and starts a new segment, and
+    load() returns the snapshot plus the records of all segments written
+    after it. Segments are numbered and the snapshot remembers the last one
+    it covers, so a crash half way through a compaction never replays a
+    record twice.
+
+    Processes forked after load() keep appending to the segment they
+    inherited, one whole line per write to a file opened for appending, but
+    only the process that loaded the journal compacts it: a forked process
+    only knows its own share of the scores, and would delete segments the
+    others are still writing to. Their records are compacted when the
+    journal is next loaded.
+    '''
+    def __init__(self, prefix=JOURNAL_FILE_PREFIX, snapshot_file=SNAPSHOT_FILE_NAME,
+                 fsync_every=FSYNC_EVERY, fsync_interval=FSYNC_INTERVAL,
+                 compact_every=COMPACT_EVERY):
+        self._prefix = prefix
+        self._snapshot_file = snapshot_file
+        self._fsync_every = fsync_every
+        self._fsync_interval = fsync_interval
+        self._compact_every = compact_every
+
+        self._file = None
+        self._generation = 0
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._since_snapshot = 0
+
+        self._compaction = None
+        self._pid = None  # Process that loaded the journal.
+        self._syncing = None  # (<pid>, result of the fsync in flight)
+
+    def load(self):
+        self._pid = os.getpid()
+        state = None
+        covered = -1
+        try:
+            with open(self._snapshot_file, 'r') as file:
+                snapshot = json.load(file)
+                state = snapshot["state"]
+                covered = snapshot["generation"]
+        except FileNotFoundError:
+            logger.debug("No score snapshot found.")
+
+        records = []
+        generations = self._generations()
+        for generation in generations:
+            if generation <= covered:
+                continue
+            records.extend(self._read_segment(generation))
+
+        logger.debug(f"Replaying {len(records)} score records after snapshot.")
+        self._since_snapshot = len(records)
+
+        # Keep appending to the newest segment unless the snapshot covers it.
+        if generations and generations[-1] > covered:
+            self._open_segment(generations[-1])
+        else:
+            self._open_segment(covered + 1)
+        return state, records
+
+    def append(self, record):
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+
+        self._unsynced += 1
+        self._since_snapshot += 1
+        if (self._unsynced >= self._fsync_every or
+                time.monotonic() - self._last_sync >= self._fsync_interval):
+            self._sync_in_background()
+
+    def sync(self):
+        # Returns once everything appended so far is on disk, waiting
+        # cooperatively.
+        if self._unsynced > 0:
+            gevent.get_hub().threadpool.apply(os.fsync, (self._file.fileno(),))
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _sync_in_background(self):
+        # One fsync in flight at a time; records appended meanwhile wait for
+        # the next one.
+        if (self._syncing is not None and self._syncing[0] == os.getpid() and
+                not self._syncing[1].ready()):
+            return
+        # A file of its own, since the segment may be closed before the
+        # sync is done.
+        fd = os.dup(self._file.fileno())
+        self._syncing = (os.getpid(), gevent.get_hub().threadpool.spawn(_fsync_and_close, fd))
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def needs_compaction(self):
+        return (self._since_snapshot >= self._compact_every and
+                os.getpid() == self._pid and not self.compacting())
+
+    def compacting(self):
+        return self._compaction is not None and not self._compaction.ready()
+
+    '''
+    Writes state to the snapshot. With background, state is serialised and
+    written in a thread of the gevent hub's threadpool, so it must be a
+    copy that nobody changes any more; compacting on the hub would keep every
+    greenlet waiting for as long as serialising a large state takes.
+    '''
+    def compact(self, state, background=False):
+        if os.getpid() != self._pid:
+            logger.debug("Not compacting the score journal of another process.")
+            self.sync()
+            return
+        if self.compacting():
+            self._compaction.wait()
+
+        # The state matches the segments closed now.
+        covered = self._generation
+
+        self.sync()
+        self._file.close()
+        self._open_segment(covered + 1)
+        self._since_snapshot = 0
+
+        if background:
+            self._compaction = gevent.get_hub().threadpool.spawn(
+                self._write_snapshot, state, covered)
+        else:
+            self._write_snapshot(state, covered)
+
+    def close(self):
+        if self.compacting():
+            self._compaction.wait()
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
+
+    def _write_snapshot(self, state, covered):
+        # Encoded piece by piece rather than with json.dumps, which holds
+        # the GIL for the whole state and would stall the hub from the
+        # threadpool just the same.
+        chunks = json.JSONEncoder().iterencode({"generation": covered, "state": state})
+        tmp_file_name = self._snapshot_file + ".tmp"
+        with open(tmp_file_name, 'w') as file:
+            for chunk in chunks:
+                file.write(chunk)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_file_name, self._snapshot_file)
+
+        for generation in self._generations():
+            if generation <= covered:
+                os.remove(self._segment_file_name(generation))
+
+        logger.debug(f"Compacted score journal up to segment {covered}.")
+
+    def _open_segment(self, generation):
+        self._generation = generation
+        self._file = open(self._segment_file_name(generation), 'a')
+
+    def _read_segment(self, generation):
+        records = []
+        with open(self._segment_file_name(generation), 'r') as file:
+            for line in file:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # Only the last line of a segment can be cut short, by
+                    # a crash in the middle of a write.
+                    logger.warning(f"Skipping torn record in journal segment {generation}")
+        return records
+
+    def _segment_file_name(self, generation):
+        return f"{self._prefix}.{generation}.txt"
+
+    def _generations(self):
+        pattern = re.compile(re.escape(self._prefix) + r"\.(\d+)\.txt$")
+        generations = []
+        for file_name in glob.glob(glob.escape(self._prefix) + ".*.txt"):
+            match = pattern.search(file_name)
+            if match:
+                generations.append(int(match.group(1)))
+        return sorted(generations)
+
+def _fsync_and_close(fd):
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
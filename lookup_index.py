@@ -0,0 +1,144 @@
+import bisect
+import unicodedata
+import zlib
+
+from log import get_logger
+
+logger = get_logger()
+
+MAX_EDIT_DISTANCE = 1
+DEFAULT_SUGGESTIONS = 10
+
+def fold(word):
+    '''
+    Lowercases a word and folds it to plain ASCII letters where German
+    spelling allows it: "ß" becomes "ss" and umlauts (and any other accented
+    letters) lose their marks, so "Übung", "ubung" and "UBUNG" share a key.
+    '''
+    word = word.lower().replace("ß", "ss")
+    word = unicodedata.normalize("NFKD", word)
+    return "".join(c for c in word if not unicodedata.combining(c))
+
+class LookupIndex:
+    '''
+    Suggestion index over the words of a deck, answering three kinds of
+    queries on folded keys (see fold()):
+
+    - exact: the words sharing the query's key, e.g. "Ubung" -> "Übung"
+    - prefix: completions of the query, from a bisect over the sorted keys
+    - fuzzy: words within one edit (insertion, deletion, substitution or
+      swap of neighbouring letters) of the query. Every key is stored once
+      as is and once with each of its letters deleted; two keys are at most
+      one edit apart only if they share one of these variants, so a query
+      only needs to look up its own variants. The variants are kept as CRC32
+      hashes in one sorted numpy array rather than a dict of strings, which
+      keeps a 100k word deck at a few MB, and every candidate is verified.
+    '''
+    def __init__(self, words):
+        import numpy as np
+
+        by_key = {}
+        for word in words:
+            by_key.setdefault(fold(word), []).append(word)
+
+        self._keys = sorted(by_key)
+        self._words = [by_key[key] for key in self._keys]
+
+        hashes = []
+        ids = []
+        for key_id, key in enumerate(self._keys):
+            for variant in _variants(key):
+                hashes.append(_hash(variant))
+                ids.append(key_id)
+
+        order = np.argsort(np.array(hashes, dtype=np.uint32), kind="stable")
+        self._hashes = np.array(hashes, dtype=np.uint32)[order]
+        self._ids = np.array(ids, dtype=np.uint32)[order]
+
+        logger.debug(f"Built lookup index over {len(self._keys)} keys.")
+
+    def exact(self, query):
+        key = fold(query)
+        pos = bisect.bisect_left(self._keys, key)
+        if pos < len(self._keys) and self._keys[pos] == key:
+            return list(self._words[pos])
+        return []
+
+    def prefix(self, query, limit=DEFAULT_SUGGESTIONS):
+        key = fold(query)
+        ret = []
+        pos = bisect.bisect_left(self._keys, key)
+        while pos < len(self._keys) and self._keys[pos].startswith(key):
+            ret.extend(self._words[pos])
+            if len(ret) >= limit:
+                break
+            pos += 1
+        return ret[:limit]
+
+    def fuzzy(self, query, limit=DEFAULT_SUGGESTIONS):
+        import numpy as np
+
+        key = fold(query)
+        query_hashes = np.array([_hash(v) for v in _variants(key)], dtype=np.uint32)
+        starts = np.searchsorted(self._hashes, query_hashes, side="left")
+        ends = np.searchsorted(self._hashes, query_hashes, side="right")
+
+        candidates = set()
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            candidates.update(self._ids[start:end].tolist())
+
+        matches = []
+        for key_id in candidates:
+            distance = _edit_distance(key, self._keys[key_id], MAX_EDIT_DISTANCE)
+            if distance <= MAX_EDIT_DISTANCE:
+                matches.append((distance, self._keys[key_id], key_id))
+        matches.sort()
+
+        ret = []
+        for _, _, key_id in matches:
+            ret.extend(self._words[key_id])
+        return ret[:limit]
+
+    def suggest(self, query, limit=DEFAULT_SUGGESTIONS):
+        # Exact matches first, then completions, then near misses.
+        ret = []
+        for words in (self.exact(query), self.prefix(query, limit), self.fuzzy(query, limit)):
+            for word in words:
+                if word not in ret:
+                    ret.append(word)
+            if len(ret) >= limit:
+                break
+        return ret[:limit]
+
+    def __len__(self):
+        return len(self._keys)
+
+def _variants(key):
+    variants = {key}
+    for i in range(len(key)):
+        variants.add(key[:i] + key[i + 1:])
+    return variants
+
+def _hash(value):
+    return zlib.crc32(value.encode())
+
+def _edit_distance(a, b, max_distance):
+    # Optimal string alignment distance (Levenshtein plus swaps of
+    # neighbouring letters), giving up early once it exceeds max_distance.
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+
+    prev2 = None
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        curr = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            curr[j] = min(prev[j] + 1, curr[j - 1] + 1, prev[j - 1] + cost)
+            if (prev2 is not None and i > 1 and j > 1 and
+                    a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]):
+                curr[j] = min(curr[j], prev2[j - 2] + 1)
+        if min(curr) > max_distance:
+            return max_distance + 1
+        prev2, prev = prev, curr
+    return prev[len(b)]
@@ -0,0 +1,241 @@
+import bisect
+import functools
+import math
+import time
+
+from log import get_logger
+
+logger = get_logger()
+
+# Upper bounds of the latency buckets, in seconds.
+DEFAULT_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+DEFAULT_LAG_INTERVAL = 0.5  # seconds
+DEFAULT_MAX_BLOCKING_TIME = 0.1  # seconds
+
+'''
+A small, dependency free stand in for prometheus_client: counters, gauges and
+histograms with labels, kept in one registry and rendered in the Prometheus
+text format (version 0.0.4). Every metric holds one value per combination of
+label values, created on first use.
+
+Updates are not locked. Requests run as greenlets, which never interrupt each
+other in the middle of an update, and the only real thread writing to a
+metric is gevent's monitoring thread, which only ever increments one counter.
+'''
+class Registry:
+    def __init__(self):
+        self._metrics = {}  # {<name>: <metric>}
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {_escape_help(metric.help)}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, help, labels=(), registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        if registry is not None:
+            registry.register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} takes labels {self.labels}, got {tuple(labels)}")
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def _label_string(self, key, extra=()):
+        pairs = list(zip(self.labels, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{_escape_label(v)}"' for k, v in pairs) + "}"
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values = {}  # {<label values>: <count>}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        for key, value in list(self._values.items()):
+            yield f"{self.name}{self._label_string(key)} {_format(value)}"
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values = {}     # {<label values>: <value>}
+        self._functions = {}  # {<label values>: <callable returning the value>}
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+    def set_function(self, function, **labels):
+        # The value is read from function whenever the metrics are rendered.
+        self._functions[self._key(labels)] = function
+
+    def value(self, **labels):
+        key = self._key(labels)
+        if key in self._functions:
+            return self._functions[key]()
+        return self._values.get(key, 0)
+
+    def samples(self):
+        values = dict(self._values)
+        for key, function in list(self._functions.items()):
+            try:
+                values[key] = function()
+            except Exception as e:
+                logger.warning(f"Could not read gauge {self.name}: {e}")
+        for key, value in values.items():
+            yield f"{self.name}{self._label_string(key)} {_format(value)}"
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        super().__init__(name, help, labels, registry)
+        self._buckets = sorted(buckets)
+        self._values = {}  # {<label values>: [<count per bucket and +Inf>, <sum>]}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        entry = self._values.get(key)
+        if entry is None:
+            entry = self._values[key] = [[0] * (len(self._buckets) + 1), 0.0]
+        # Counts are kept per bucket and only made cumulative when rendered.
+        entry[0][bisect.bisect_left(self._buckets, value)] += 1
+        entry[1] += value
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def count(self, **labels):
+        entry = self._values.get(self._key(labels))
+        return sum(entry[0]) if entry is not None else 0
+
+    def samples(self):
+        for key, (counts, total) in list(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self._buckets + [math.inf], counts):
+                cumulative += count
+                le = "+Inf" if bound == math.inf else _format(bound)
+                yield f"{self.name}_bucket{self._label_string(key, [('le', le)])} {cumulative}"
+            yield f"{self.name}_sum{self._label_string(key)} {_format(total)}"
+            yield f"{self.name}_count{self._label_string(key)} {cumulative}"
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self._histogram = histogram
+        self._labels = labels
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._histogram.observe(time.perf_counter() - self._start, **self._labels)
+
+FUNCTION_DURATION = Histogram(
+    "spiel_function_duration_seconds",
+    "Time spent in instrumented functions.",
+    labels=["function"])
+
+def timed(name=None, histogram=FUNCTION_DURATION):
+    '''
+    Decorator recording how long every call of the decorated function takes,
+    under the function label name (its qualified name by default).
+    '''
+    def decorator(f):
+        label = name or f.__qualname__
+
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            with histogram.time(function=label):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+LOOP_LAG = Histogram(
+    "spiel_event_loop_lag_seconds",
+    "How late the gevent hub woke up a sleeping greenlet.",
+    buckets=[0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5])
+LOOP_BLOCKED = Counter(
+    "spiel_event_loop_blocked_total",
+    "Times a greenlet kept the gevent hub from running for longer than the "
+    "maximum blocking time.")
+
+_loop_monitor = None
+
+def start_loop_monitor(interval=DEFAULT_LAG_INTERVAL, max_blocking_time=DEFAULT_MAX_BLOCKING_TIME):
+    '''
+    Starts watching the gevent hub, which every request shares: a greenlet
+    sleeping interval seconds at a time records how late it is woken up, and
+    gevent's monitoring thread reports every greenlet that runs for longer
+    than max_blocking_time without yielding, with its stack, to the log.
+    Safe to call more than once.
+    '''
+    global _loop_monitor
+    if _loop_monitor is not None:
+        return
+
+    import gevent
+    from gevent import events
+
+    def measure_lag():
+        while True:
+            start = time.perf_counter()
+            gevent.sleep(interval)
+            LOOP_LAG.observe(max(time.perf_counter() - start - interval, 0))
+
+    def on_event(event):
+        if isinstance(event, events.EventLoopBlocked):
+            LOOP_BLOCKED.inc()
+            logger.warning(
+                f"Event loop blocked for more than {event.blocking_time}s by "
+                f"{event.greenlet}:\n" + "\n".join(event.info))
+
+    gevent.config.monitor_thread = True
+    gevent.config.max_blocking_time = max_blocking_time
+    events.subscribers.append(on_event)
+    gevent.get_hub().start_periodic_monitoring_thread()
+    _loop_monitor = gevent.spawn(measure_lag)
+
+def _format(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        return repr(value)
+    return str(value)
+
+def _escape_help(text):
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+def _escape_label(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
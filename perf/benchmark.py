@@ -0,0 +1,298 @@
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import gevent
+
+CURR_DIR = os.path.dirname(os.path.realpath(__file__))
+REPO_DIR = os.path.dirname(CURR_DIR)
+sys.path.append(REPO_DIR)
+
+from deck import compile_deck, default_shared_dir
+from log import get_logger
+from synthetic import write_deck, parse_size, DUMP_FILE_NAME
+
+logger = get_logger()
+
+DEFAULT_SIZE = "10k"
+DEFAULT_HISTORY_LENGTH = 20
+DEFAULT_REPEAT = 5
+DEFAULT_THRESHOLD = 0.2  # Slowdowns of more than 20% are flagged.
+LOG_SCORE_DISK_CALLS = 20000  # Enough for the journal to compact twice a round.
+
+'''
+Microbenchmarks of the core DeutschesSpiel operations over a synthetic deck
+(see synthetic.py) and synthetic score histories. Every benchmark runs a
+number of calls repeat times and reports the per call time of the median and
+the fastest round. The deck and the score journal live on tmpfs where there
+is one, so that disk latency does not swamp the numbers; "log_score no fsync"
+runs there with journal compaction off, which "compact_scores" measures on its
+own. "log_score disk" is the cost a server pays per score: its journal is in a
+directory on the real filesystem (under the working directory unless
+--disk-dir says otherwise), fsyncs and compactions included.
+
+Results can be saved as a JSON baseline and later runs compared against it;
+a benchmark whose median is more than the threshold slower than its baseline
+is flagged, and the run exits with status 1, so a change to spiel.py can be
+checked with
+
+    python perf/benchmark.py --save before.json
+    <change>
+    python perf/benchmark.py --compare before.json
+'''
+
+def measure(fn, number, repeat=DEFAULT_REPEAT):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        times.append((time.perf_counter() - start) / number)
+    return {
+        "median_us": statistics.median(times) * 1e6,
+        "min_us": min(times) * 1e6,
+        "number": number,
+        "repeat": repeat
+    }
+
+def make_histories(words, n, length, seed=0):
+    # Score histories of n words, each trending up or down with some noise.
+    rand = random.Random(seed)
+    histories = {}
+    for word in rand.sample(words, min(n, len(words))):
+        slope = rand.uniform(-3, 3)
+        start = rand.uniform(20, 80)
+        histories[word] = [
+            max(0, min(100, round(start + slope * i + rand.gauss(0, 10))))
+            for i in range(length)]
+    return histories
+
+def make_answer_pairs(game, words, n, seed=0):
+    # n distinct (answer, translation) pairs, about half of them right and
+    # half another word's translation, so that every scoring call misses the
+    # similarity caches, as a new answer would. Answers that would repeat a
+    # pair get a stray word appended.
+    rand = random.Random(seed)
+    pairs = {}
+    while len(pairs) < n:
+        translation = game.lookup(rand.choice(words))["translation"]
+        answer = translation
+        if rand.random() < 0.5:
+            answer = game.lookup(rand.choice(words))["translation"]
+        if (answer, translation) in pairs:
+            answer += f" x{len(pairs)}"
+        pairs[(answer, translation)] = None
+    return list(pairs)
+
+def run(size, history_words=None, history_length=DEFAULT_HISTORY_LENGTH,
+        repeat=DEFAULT_REPEAT, only=None, seed=0, disk_dir=None):
+    '''
+    Runs the benchmarks (those named in only, if given) in a temporary
+    directory holding a synthetic deck of size entries, and returns their
+    results by name. "log_score disk" gets a copy of the deck in a temporary
+    directory under disk_dir, the working directory by default.
+    '''
+    if history_words is None:
+        history_words = max(size // 10, 1)
+
+    directory = tempfile.mkdtemp(prefix="spiel_benchmark_", dir=default_shared_dir())
+    cwd = os.getcwd()
+    try:
+        write_deck(directory, size, seed=seed)
+        compile_deck(os.path.join(directory, DUMP_FILE_NAME),
+                     os.path.join(directory, "_deck.bin"))
+        # The game reads its files from the working directory.
+        os.chdir(directory)
+
+        from spiel import DeutschesSpiel, SemanticComparator
+
+        game = DeutschesSpiel(use_multimode=True)
+        # Compactions are measured by "compact_scores", not by whichever
+        # log_score call happens to trigger one.
+        game._journal._compact_every = sys.maxsize
+        words = game.list()
+        rand = random.Random(seed)
+        histories = make_histories(words, history_words, history_length, seed)
+        # Calls of the scoring benchmarks, each of which gets a pair of its
+        # own, warm-up call included.
+        score_calls = {"answer_score fuzzy": 2000, "answer_score semantic": 500}
+        pair_iter = iter(make_answer_pairs(
+            game, words, sum(n * repeat + 1 for n in score_calls.values()), seed))
+
+        cursor = game.new_cursor()
+        serial_starts = _cycle(rand.sample(words, min(1000, len(words))))
+        lookup_words = _cycle(rand.sample(words, min(1000, len(words))))
+        # Lowercase without umlauts or ß, so only the folded index finds them.
+        folded_words = _cycle([w.replace("ä", "a").replace("ö", "o").replace("ü", "u").replace("ß", "ss")
+                               for w in rand.sample(words, min(1000, len(words)))])
+        score_words = _cycle(list(histories) or words)
+
+        benchmarks = {
+            "construct": (lambda: DeutschesSpiel(use_multimode=True), 1),
+            "next_entry word random": (lambda: game.get_next_entry("word", cursor=cursor), 2000),
+            "next_entry word serial": (lambda: game.get_next_entry("word", serial=True, cursor=cursor), 2000),
+            "next_entry word serial start": (
+                lambda: game.get_next_entry("word", serial=True, start=next(serial_starts), cursor=cursor), 2000),
+            "next_entry preposition random": (
+                lambda: game.get_next_entry("preposition", cursor=cursor), 2000),
+            "next_entry preposition serial": (
+                lambda: game.get_next_entry("preposition", serial=True, cursor=cursor), 2000),
+            "next_entry due": (lambda: game.get_next_entry("due", cursor=cursor), 2000),
+            "next_entry multimode": (lambda: game.get_next_entry(cursor=cursor), 2000),
+            "lookup": (lambda: game.lookup(next(lookup_words)), 5000),
+            "lookup folded": (lambda: game.lookup(next(folded_words)), 2000),
+            "answer_score fuzzy": (
+                lambda: game.get_answer_score(*next(pair_iter)), score_calls["answer_score fuzzy"]),
+            "sort_words": (lambda: game.sort_words(histories), 3),
+            "log_score no fsync": (lambda: game._log_score(next(score_words), rand.randint(0, 100)), 2000),
+            "compact_scores": (lambda: game._journal.compact(game._score_state()), 3),
+        }
+
+        results = {}
+        for name, (fn, number) in benchmarks.items():
+            if only and name not in only:
+                continue
+            # One call before measuring, for lazily built indexes.
+            fn()
+            results[name] = measure(fn, number, repeat)
+            logger.info(f"{name}: {results[name]['median_us']:.1f} us")
+
+        if not only or "answer_score semantic" in only:
+            try:
+                if not SemanticComparator.is_loaded():
+                    SemanticComparator.load()
+            except (ImportError, OSError) as e:
+                logger.warning(f"Skipping semantic scoring, spaCy model not available: {e}")
+            else:
+                semantic_game = DeutschesSpiel(use_semantic=True, use_multimode=True)
+                fn = lambda: semantic_game.get_answer_score(*next(pair_iter))
+                fn()
+                results["answer_score semantic"] = measure(
+                    fn, score_calls["answer_score semantic"], repeat)
+
+        if not only or "log_score disk" in only:
+            results["log_score disk"] = _measure_log_score_on_disk(
+                directory, disk_dir or cwd, score_words, repeat, seed)
+            logger.info(f"log_score disk: {results['log_score disk']['median_us']:.1f} us")
+
+        return results
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(directory, ignore_errors=True)
+
+'''
+Measures log_score with the score journal in a temporary directory under
+parent_dir, holding a copy of the deck in deck_dir. The hub gets a turn after
+every call, as it would between requests, so that fsyncs and compactions in
+its threadpool finish and the next ones start.
+'''
+def _measure_log_score_on_disk(deck_dir, parent_dir, score_words, repeat, seed):
+    from spiel import DeutschesSpiel
+
+    directory = tempfile.mkdtemp(prefix="spiel_benchmark_", dir=parent_dir)
+    cwd = os.getcwd()
+    try:
+        for name in os.listdir(deck_dir):
+            if not name.startswith("_scores"):
+                shutil.copy(os.path.join(deck_dir, name), directory)
+        os.chdir(directory)
+
+        game = DeutschesSpiel(use_multimode=True)
+        rand = random.Random(seed)
+
+        def log_score():
+            game._log_score(next(score_words), rand.randint(0, 100))
+            gevent.sleep(0)
+
+        log_score()
+        result = measure(log_score, LOG_SCORE_DISK_CALLS, repeat)
+        # The journal's files are relative to the directory, so it has to be
+        # done with them before we leave it.
+        game._journal.close()
+        return result
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(directory, ignore_errors=True)
+
+def _cycle(values):
+    while True:
+        yield from values
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    # Returns [(<name>, <baseline median>, <median>, <change>, <regressed>)].
+    ret = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]["median_us"]
+        change = result["median_us"] / before - 1 if before > 0 else 0.0
+        ret.append((name, before, result["median_us"], change, change > threshold))
+    return ret
+
+def print_results(results):
+    print(f"{'benchmark':<32} {'median us':>12} {'min us':>12} {'calls':>7}")
+    for name, r in results.items():
+        print(f"{name:<32} {r['median_us']:>12.1f} {r['min_us']:>12.1f} {r['number']:>7}")
+
+def print_comparison(comparison, threshold):
+    print(f"{'benchmark':<32} {'baseline us':>12} {'median us':>12} {'change':>8}")
+    for name, before, after, change, regressed in comparison:
+        flag = "  SLOWER" if regressed else ""
+        print(f"{name:<32} {before:>12.1f} {after:>12.1f} {change:>+8.1%}{flag}")
+    regressions = [c for c in comparison if c[4]]
+    if regressions:
+        print(f"\n{len(regressions)} benchmark(s) more than {threshold:.0%} slower than the baseline.")
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the core DeutschesSpiel operations")
+    parser.add_argument('--size', default=DEFAULT_SIZE, help='Deck size, e.g. 1k, 10k, 100k or 5000')
+    parser.add_argument('--history-words', type=int, help='Words with a score history (default: a tenth of the deck)')
+    parser.add_argument('--history-length', type=int, default=DEFAULT_HISTORY_LENGTH, help='Scores per history')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='Rounds per benchmark')
+    parser.add_argument('--only', nargs='+', help='Only run these benchmarks')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    parser.add_argument('--disk-dir', help='Where "log_score disk" keeps its journal (default: the working directory)')
+    parser.add_argument('--save', help='Write the results to this baseline file')
+    parser.add_argument('--compare', help='Compare the results with this baseline file')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='Relative slowdown flagged when comparing, e.g. 0.2 for 20%%')
+
+    args = parser.parse_args()
+    size = parse_size(args.size)
+    results = run(size, args.history_words, args.history_length, args.repeat, args.only, args.seed,
+                  args.disk_dir)
+
+    print_results(results)
+
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump({
+                "meta": {
+                    "size": size,
+                    "history_words": args.history_words,
+                    "history_length": args.history_length,
+                    "python": platform.python_version(),
+                    "machine": platform.platform(),
+                    "time": time.strftime("%Y-%m-%dT%H:%M:%S")
+                },
+                "results": results
+            }, file, indent=2)
+
+    if args.compare:
+        with open(args.compare, 'r') as file:
+            baseline = json.load(file)
+        if baseline["meta"]["size"] != size:
+            logger.warning(f"Baseline was taken with {baseline['meta']['size']} entries, not {size}.")
+        comparison = compare(results, baseline["results"], args.threshold)
+        print()
+        print_comparison(comparison, args.threshold)
+        if any(c[4] for c in comparison):
+            sys.exit(1)
@@ -0,0 +1,249 @@
+from gevent import monkey
+monkey.patch_all()
+
+import importlib
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import gevent
+import requests
+
+CURR_DIR = os.path.dirname(os.path.realpath(__file__))
+REPO_DIR = os.path.dirname(CURR_DIR)
+sys.path.append(REPO_DIR)
+
+from deck import compile_deck
+from log import get_logger
+from synthetic import write_deck, parse_size, DUMP_FILE_NAME
+
+logger = get_logger()
+
+DEFAULT_SIZES = ["1k", "10k", "100k"]
+DEFAULT_CONCURRENCY = 20
+DEFAULT_DURATION = 15.0  # seconds
+DEFAULT_WARMUP = 2.0  # seconds
+SERVER_START_TIMEOUT = 300.0  # seconds; loading 100k entries takes a while.
+
+'''
+Load test for the web app. Every deck size gets a fresh temporary directory
+with a synthetic deck (see synthetic.py) and a server of its own, started in
+a subprocess on the production server (see server.py), so the numbers cover
+the whole request path but not the load generator. Concurrent virtual
+learners then init a session and keep asking for questions, looking words up,
+listing the deck and getting answers scored, in the proportions of ROUTES,
+and the throughput and latency percentiles of every route are reported.
+'''
+
+# (<name>, <weight>) of the requests a virtual learner makes after /init.
+ROUTES = [
+    ("next_question random", 25),
+    ("next_question serial", 15),
+    ("next_questions", 5),
+    ("lookup", 15),
+    ("lookup json", 10),
+    ("list", 5),
+    ("answer_score", 25),
+]
+
+def _request(session, base_url, route, words, session_id):
+    word = random.choice(words)
+    if route == "next_question random":
+        return session.get(f"{base_url}/next_question", params={"session_id": session_id})
+    elif route == "next_question serial":
+        return session.get(f"{base_url}/next_question",
+                           params={"order": "serial", "session_id": session_id})
+    elif route == "next_questions":
+        return session.get(f"{base_url}/next_questions",
+                           params={"n": 10, "session_id": session_id})
+    elif route == "lookup":
+        return session.get(f"{base_url}/lookup", params={"wort": word["word"]})
+    elif route == "lookup json":
+        return session.get(f"{base_url}/lookup", params={"wort": word["word"], "mode": "json"})
+    elif route == "list":
+        return session.get(f"{base_url}/list")
+    elif route == "answer_score":
+        # Mostly close answers, some plain wrong ones.
+        answer = word["translation"] if random.random() < 0.7 else random.choice(words)["translation"]
+        return session.get(f"{base_url}/answer_score", params={
+            "answer": answer, "translation": word["translation"], "word": word["word"]})
+    raise ValueError(f"Unknown route {route}")
+
+def _learner(base_url, words, record_from, deadline, results):
+    names = [name for name, _ in ROUTES]
+    weights = [weight for _, weight in ROUTES]
+
+    session = requests.Session()
+    while time.monotonic() < deadline:
+        start = time.monotonic()
+        try:
+            # Like the web client, which posts the scores it keeps locally.
+            response = session.post(f"{base_url}/init", json="[]")
+            response.raise_for_status()
+            session_id = response.json()["session_id"]
+            break
+        except requests.RequestException as e:
+            _record(results, "init", start, record_from, error=e)
+    else:
+        return
+    _record(results, "init", start, record_from)
+
+    while time.monotonic() < deadline:
+        route = random.choices(names, weights)[0]
+        start = time.monotonic()
+        try:
+            response = _request(session, base_url, route, words, session_id)
+            response.raise_for_status()
+            # Read the whole body, as a browser would.
+            response.content
+        except requests.RequestException as e:
+            _record(results, route, start, record_from, error=e)
+        else:
+            _record(results, route, start, record_from)
+
+def _record(results, route, start, record_from, error=None):
+    # Requests started during the warm up are not counted.
+    if start < record_from:
+        return
+    entry = results.setdefault(route, {"latencies": [], "errors": 0})
+    if error is not None:
+        entry["errors"] += 1
+        logger.debug(f"{route} failed: {error}")
+    else:
+        entry["latencies"].append(time.monotonic() - start)
+
+def _percentile(values, p):
+    # Nearest rank on sorted values.
+    if not values:
+        return float("nan")
+    return values[min(len(values) - 1, max(0, int(round(p / 100 * len(values))) - 1))]
+
+def summarize(results, duration):
+    summary = {}
+    for route, entry in sorted(results.items()):
+        latencies = sorted(entry["latencies"])
+        summary[route] = {
+            "requests": len(latencies),
+            "errors": entry["errors"],
+            "rps": len(latencies) / duration,
+            "p50_ms": _percentile(latencies, 50) * 1000,
+            "p95_ms": _percentile(latencies, 95) * 1000,
+            "p99_ms": _percentile(latencies, 99) * 1000,
+            "max_ms": latencies[-1] * 1000 if latencies else float("nan"),
+        }
+    return summary
+
+def print_summary(size, concurrency, summary):
+    total = sum(s["rps"] for s in summary.values())
+    print(f"\n{size} entries, {concurrency} concurrent learners: {total:.1f} requests/s")
+    print(f"{'route':<22} {'requests':>9} {'errors':>7} {'req/s':>8} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for route, s in summary.items():
+        print(f"{route:<22} {s['requests']:>9} {s['errors']:>7} {s['rps']:>8.1f} "
+              f"{s['p50_ms']:>8.1f} {s['p95_ms']:>8.1f} {s['p99_ms']:>8.1f} {s['max_ms']:>8.1f}")
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def serve(directory, port):
+    # Runs in the server subprocess. The server is imported as part of its
+    # package, as it is run in production.
+    os.chdir(directory)
+    sys.path.insert(0, os.path.dirname(REPO_DIR))
+    server_module = importlib.import_module(os.path.basename(REPO_DIR) + ".server")
+    server_module.create_server(host="127.0.0.1", port=port, log=None).serve_forever()
+
+def start_server(directory, port):
+    env = dict(os.environ)
+    # Nothing changes the deck during a run, and stack dumps of every slow
+    # request would only slow the server down further.
+    env.setdefault("SPIEL_RELOAD_INTERVAL", "0")
+    env.setdefault("SPIEL_MAX_BLOCKING_TIME", "0")
+    server = subprocess.Popen(
+        [sys.executable, os.path.realpath(__file__), "--serve", directory, "--port", str(port)],
+        env=env)
+
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise Exception(f"Server exited with code {server.returncode}")
+        try:
+            requests.get(f"http://127.0.0.1:{port}/list", params={"limit": 1}, timeout=1)
+            return server
+        except requests.RequestException:
+            gevent.sleep(0.2)
+
+    server.kill()
+    raise Exception(f"Server did not start within {SERVER_START_TIMEOUT}s")
+
+def run(size, concurrency=DEFAULT_CONCURRENCY, duration=DEFAULT_DURATION,
+        warmup=DEFAULT_WARMUP, seed=0):
+    '''
+    Load tests a fresh server over a synthetic deck of size entries and
+    returns the summary of every route (see summarize()).
+    '''
+    directory = tempfile.mkdtemp(prefix="spiel_loadtest_")
+    server = None
+    try:
+        started = time.monotonic()
+        write_deck(directory, size, seed=seed)
+        compile_deck(os.path.join(directory, DUMP_FILE_NAME),
+                     os.path.join(directory, "_deck.bin"))
+        with open(os.path.join(directory, DUMP_FILE_NAME), 'r') as file:
+            words = json.load(file)
+
+        port = _free_port()
+        server = start_server(directory, port)
+        logger.info(f"Server with {size} entries up after {time.monotonic() - started:.1f}s.")
+
+        random.seed(seed)
+        results = {}
+        record_from = time.monotonic() + warmup
+        deadline = record_from + duration
+        learners = [gevent.spawn(_learner, f"http://127.0.0.1:{port}", words,
+                                 record_from, deadline, results)
+                    for _ in range(concurrency)]
+        gevent.joinall(learners, raise_error=True)
+
+        return summarize(results, duration)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        shutil.rmtree(directory, ignore_errors=True)
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Load test the web app over synthetic decks")
+    parser.add_argument('sizes', nargs='*', default=DEFAULT_SIZES, help='Deck sizes, e.g. 1k 10k 100k or 5000')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY, help='Concurrent learners')
+    parser.add_argument('--duration', type=float, default=DEFAULT_DURATION, help='Seconds measured per size')
+    parser.add_argument('--warmup', type=float, default=DEFAULT_WARMUP, help='Seconds run before measuring')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    parser.add_argument('--json', help='Also write the results to this file')
+    parser.add_argument('--serve', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+    if args.serve:
+        serve(args.serve, args.port)
+        sys.exit(0)
+
+    all_results = {}
+    for size in args.sizes:
+        summary = run(parse_size(size), args.concurrency, args.duration, args.warmup, args.seed)
+        print_summary(size, args.concurrency, summary)
+        all_results[size] = summary
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(all_results, file, indent=2)
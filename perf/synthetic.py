@@ -0,0 +1,123 @@
+import json
+import os
+import random
+
+'''
+Synthetic decks for load tests and benchmarks: a _dump.txt and a
+_prepositions.txt shaped like the ones the compiler writes, made of invented
+but German looking words, so that the app can be run at any size without
+Google Sheets, DWDS or DeepL.
+'''
+
+DUMP_FILE_NAME = "_dump.txt"
+PREPOSITIONS_FILE_NAME = "_prepositions.txt"
+
+SIZES = {"1k": 1000, "10k": 10000, "100k": 100000}
+
+_ONSETS = ["b", "d", "f", "g", "h", "k", "l", "m", "n", "p", "r", "s", "t", "w", "z",
+           "sch", "st", "sp", "pf", "kr", "tr", "br", "gr", "fl", "schw"]
+_VOWELS = ["a", "e", "i", "o", "u", "ä", "ö", "ü", "au", "ei", "ie", "eu"]
+_CODAS = ["", "n", "r", "l", "t", "s", "ch", "ck", "ng", "ß", "nd", "rt"]
+_SUFFIXES = ["", "en", "ung", "heit", "keit", "er", "chen", "lich", "ig", "schaft"]
+
+_ENGLISH = ["house", "way", "time", "hand", "day", "thing", "world", "life", "word",
+            "place", "work", "question", "home", "water", "room", "mother", "area",
+            "money", "story", "fact", "month", "lot", "right", "study", "book", "eye"]
+
+_GERMAN_FRAMES = [
+    "Das {w} ist heute besonders schön.",
+    "Ich habe gestern über {w} nachgedacht.",
+    "Ohne {w} kommt man hier nicht weiter.",
+    "Sie erzählte mir von ihrem {w} in Berlin.",
+    "Wir brauchen mehr {w} für das Projekt.",
+    "Kannst du mir das {w} noch einmal erklären?",
+]
+_ENGLISH_FRAMES = [
+    "The {w} is especially nice today.",
+    "Yesterday I thought about {w}.",
+    "Without {w} you do not get any further here.",
+    "She told me about her {w} in Berlin.",
+    "We need more {w} for the project.",
+    "Can you explain the {w} to me once more?",
+]
+
+_PREPOSITIONS = [("an", "acc"), ("auf", "acc"), ("für", "acc"), ("über", "acc"),
+                 ("mit", "dat"), ("von", "dat"), ("zu", "dat"), ("nach", "dat"),
+                 ("vor", "dat"), ("bei", "dat")]
+
+def make_words(n, seed=0):
+    # n distinct capitalized pseudo German words.
+    rand = random.Random(seed)
+    words = set()
+    while len(words) < n:
+        syllables = rand.randint(1, 3)
+        word = "".join(rand.choice(_ONSETS) + rand.choice(_VOWELS) + rand.choice(_CODAS)
+                       for _ in range(syllables))
+        words.add((word + rand.choice(_SUFFIXES)).capitalize())
+    # Sorted before shuffling so that the order only depends on the seed.
+    words = sorted(words)
+    rand.shuffle(words)
+    return words
+
+def make_dump(n, seed=0):
+    rand = random.Random(seed)
+    entries = []
+    for word in make_words(n, seed):
+        translation = " ".join(rand.sample(_ENGLISH, rand.randint(1, 2)))
+        examples = []
+        for frame in rand.sample(range(len(_GERMAN_FRAMES)), rand.randint(1, 4)):
+            examples.append([_GERMAN_FRAMES[frame].format(w=word),
+                             _ENGLISH_FRAMES[frame].format(w=translation)])
+        entries.append({
+            "word": word,
+            "de_to_en": rand.random() < 0.9,
+            "translation": translation,
+            "examples": examples,
+            "metadata": {"genus": [rand.choice(["der", "die", "das"])]},
+            "synonyms": ", ".join(rand.sample(_ENGLISH, 2)) if rand.random() < 0.3 else ""
+        })
+    return entries
+
+def make_prepositions(n, seed=0):
+    rand = random.Random(seed)
+    prepositions = []
+    for verb in make_words(n, seed + 1):
+        preposition, akk_dat = rand.choice(_PREPOSITIONS)
+        prepositions.append({
+            "verb": "sich " + verb.lower() + "en" if rand.random() < 0.3 else verb.lower() + "en",
+            "preposition": preposition,
+            "akk_dat": akk_dat,
+            "bedeutung": " ".join(rand.sample(_ENGLISH, 2))
+        })
+    return prepositions
+
+def write_deck(directory, n, prepositions=None, seed=0):
+    '''
+    Writes a synthetic dump of n entries and a prepositions file (n // 10 by
+    default, at least 10) into directory.
+    '''
+    if prepositions is None:
+        prepositions = max(n // 10, 10)
+
+    with open(os.path.join(directory, DUMP_FILE_NAME), 'w') as file:
+        json.dump(make_dump(n, seed), file, ensure_ascii=False)
+    with open(os.path.join(directory, PREPOSITIONS_FILE_NAME), 'w') as file:
+        json.dump(make_prepositions(prepositions, seed), file, ensure_ascii=False)
+
+def parse_size(size):
+    # "10k" or "10000".
+    if size in SIZES:
+        return SIZES[size]
+    return int(size)
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Write a synthetic dump and prepositions file")
+    parser.add_argument('size', help=f'Number of entries, e.g. 10000 or one of {", ".join(SIZES)}')
+    parser.add_argument('directory', nargs='?', default=".", help='Directory to write the files to')
+    parser.add_argument('--prepositions', type=int, help='Number of prepositions (default: a tenth of the entries)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+
+    args = parser.parse_args()
+    write_deck(args.directory, parse_size(args.size), args.prepositions, args.seed)
@@ -0,0 +1,211 @@
+import bisect
+from collections.abc import Sequence
+from itertools import accumulate, chain
+
+BLOCK_SIZE = 512  # Ranked words per block; a block is split at twice that.
+
+class DifficultyRanking:
+    '''
+    Words ordered by the slope of the least-squares trend line through their
+    scores (taken in chronological order, x = 1, 2, ...), lowest slope first.
+
+    Only the running sums n, sum(y) and sum(x*y) are kept per word; sum(x) and
+    sum(x^2) follow from n. That makes a new score an O(1) slope update and
+    a move in the ranked order instead of a refit and a full re-sort. The
+    order is kept in sorted blocks of about BLOCK_SIZE words, with the last
+    key of every block alongside: a move bisects the block keys, then the
+    block, and deletes and inserts within that block only, so it costs
+    O(log n) comparisons and moves at most 2 * BLOCK_SIZE pointers however
+    many words are ranked.
+
+    words is a RankedWords that is never changed: after an update the next
+    read returns a new one, so readers holding on to it keep walking one
+    consistent order. It shares the word blocks with the ranking, which
+    copies a block before changing one that has been handed out, so a read
+    after an update costs O(n / BLOCK_SIZE) rather than a copy of every word.
+    '''
+    def __init__(self):
+        self._key_blocks = []  # [[(<slope>, <word>)]], sorted within and across blocks.
+        self._word_blocks = []  # The words of _key_blocks, in the same order.
+        self._maxes = []  # [<last key of each block>]
+        self._shared = []  # [<whether the snapshot has the word block>]
+        self._snapshot = None  # The ranked words as of the last read of words.
+
+        self._sums = {}  # {<word>: [<n>, <sum_y>, <sum_xy>, <slope>]}
+
+    @property
+    def words(self):
+        if self._snapshot is None:
+            self._snapshot = RankedWords(tuple(self._word_blocks))
+            self._shared = [True] * len(self._word_blocks)
+        return self._snapshot
+
+    @classmethod
+    def from_histories(cls, histories):
+        # Slopes for all words in one vectorized pass over the scores laid
+        # out back to back, instead of a polyfit per word. numpy is only
+        # imported once there are histories to rank.
+        import numpy as np
+
+        ranking = cls()
+
+        words = [w for w, scores in histories.items() if len(scores) > 0]
+        if not words:
+            return ranking
+
+        lengths = np.fromiter(
+            (len(histories[w]) for w in words), dtype=np.int64, count=len(words))
+        scores = np.fromiter(
+            chain.from_iterable(histories[w] for w in words),
+            dtype=np.float64, count=int(lengths.sum()))
+
+        starts = np.zeros(len(words), dtype=np.int64)
+        np.cumsum(lengths[:-1], out=starts[1:])
+        x = np.arange(scores.size) - np.repeat(starts, lengths) + 1
+
+        sum_y = np.add.reduceat(scores, starts)
+        sum_xy = np.add.reduceat(scores * x, starts)
+        slopes = _slopes(lengths, sum_y, sum_xy)
+
+        for word, n, sy, sxy, slope in zip(
+                words, lengths.tolist(), sum_y.tolist(), sum_xy.tolist(),
+                slopes.tolist()):
+            ranking._sums[word] = [n, sy, sxy, slope]
+
+        ranking._load(sorted(zip(slopes.tolist(), words)))
+        return ranking
+
+    @classmethod
+    def from_sums(cls, sums):
+        # Restores a ranking saved with sums().
+        ranking = cls()
+        for word, (n, sy, sxy) in sums.items():
+            ranking._sums[word] = [n, sy, sxy, _slope(n, sy, sxy)]
+
+        ranking._load(sorted((v[3], word) for word, v in ranking._sums.items()))
+        return ranking
+
+    def sums(self):
+        return {word: v[:3] for word, v in self._sums.items()}
+
+    def update(self, word, score):
+        sums = self._sums.get(word)
+        if sums is None:
+            sums = self._sums[word] = [0, 0.0, 0.0, 0.0]
+        else:
+            self._remove((sums[3], word))
+
+        sums[0] += 1
+        sums[1] += score
+        sums[2] += sums[0] * score
+        sums[3] = _slope(sums[0], sums[1], sums[2])
+
+        self._insert((sums[3], word))
+        self._snapshot = None
+
+    def slope(self, word):
+        return self._sums[word][3]
+
+    def __len__(self):
+        return len(self._sums)
+
+    def _load(self, keys):
+        # Blocks of the sorted keys, each half full so that inserts have
+        # room before the first split.
+        self._key_blocks = [keys[i:i + BLOCK_SIZE] for i in range(0, len(keys), BLOCK_SIZE)]
+        self._word_blocks = [[word for _, word in block] for block in self._key_blocks]
+        self._maxes = [block[-1] for block in self._key_blocks]
+        self._shared = [False] * len(self._key_blocks)
+        self._snapshot = None
+
+    def _remove(self, key):
+        i = bisect.bisect_left(self._maxes, key)
+        keys = self._key_blocks[i]
+        pos = bisect.bisect_left(keys, key)
+        del keys[pos]
+        if keys:
+            del self._own_words(i)[pos]
+            self._maxes[i] = keys[-1]
+        else:
+            del self._key_blocks[i]
+            del self._word_blocks[i]
+            del self._maxes[i]
+            del self._shared[i]
+
+    def _insert(self, key):
+        if not self._maxes:
+            self._key_blocks.append([key])
+            self._word_blocks.append([key[1]])
+            self._maxes.append(key)
+            self._shared.append(False)
+            return
+
+        # Keys past the last block's go at the end of it.
+        i = bisect.bisect_left(self._maxes, key)
+        if i == len(self._maxes):
+            i -= 1
+            self._maxes[i] = key
+        keys = self._key_blocks[i]
+        words = self._own_words(i)
+        pos = bisect.bisect_left(keys, key)
+        keys.insert(pos, key)
+        words.insert(pos, key[1])
+
+        if len(keys) > 2 * BLOCK_SIZE:
+            self._key_blocks.insert(i + 1, keys[BLOCK_SIZE:])
+            self._word_blocks.insert(i + 1, words[BLOCK_SIZE:])
+            del keys[BLOCK_SIZE:]
+            del words[BLOCK_SIZE:]
+            self._maxes.insert(i, keys[-1])
+            self._shared.insert(i + 1, False)
+
+    def _own_words(self, i):
+        # The words of block i, copied first if the snapshot has them.
+        if self._shared[i]:
+            self._word_blocks[i] = self._word_blocks[i][:]
+            self._shared[i] = False
+        return self._word_blocks[i]
+
+class RankedWords(Sequence):
+    '''
+    The ranked words as of one read of DifficultyRanking.words, indexed
+    through the blocks they are kept in.
+    '''
+    __slots__ = ("_blocks", "_starts")
+
+    def __init__(self, blocks):
+        self._blocks = blocks
+        self._starts = list(accumulate(map(len, blocks), initial=0))
+
+    def __len__(self):
+        return self._starts[-1]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return tuple(self)[index]
+        if index < 0:
+            index += self._starts[-1]
+        if not 0 <= index < self._starts[-1]:
+            raise IndexError("ranked word index out of range")
+        i = bisect.bisect_right(self._starts, index) - 1
+        return self._blocks[i][index - self._starts[i]]
+
+    def __iter__(self):
+        return chain.from_iterable(self._blocks)
+
+def _slope(n, sum_y, sum_xy):
+    if n < 2:
+        return 0.0
+    sum_x = n * (n + 1) / 2
+    denominator = n * n * (n * n - 1) / 12  # n*sum(x^2) - sum(x)^2
+    return (n * sum_xy - sum_x * sum_y) / denominator
+
+def _slopes(n, sum_y, sum_xy):
+    import numpy as np
+
+    n = n.astype(np.float64)
+    sum_x = n * (n + 1) / 2
+    denominator = n * n * (n * n - 1) / 12
+    numerator = n * sum_xy - sum_x * sum_y
+    return np.divide(numerator, denominator,
+                     out=np.zeros_like(numerator), where=denominator > 0)
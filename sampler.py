@@ -0,0 +1,39 @@
+import random
+
+class PermutationSampler:
+    '''
+    Draws indices 0..n-1 in a random order without repeating any of them
+    until all n have been drawn, after which a new epoch with a fresh order
+    starts. The permutation is shuffled lazily (Fisher-Yates with only the
+    swapped slots kept in a dict), so every draw is O(1) and the memory held
+    is proportional to the draws made in the current epoch, not to n.
+    '''
+    def __init__(self, n):
+        self.n = n
+        self.epoch = 0
+
+        self._remaining = n
+        self._swaps = {}  # {<slot>: <index now sitting in that slot>}
+
+    def draw(self):
+        if self.n == 0:
+            raise IndexError("Cannot draw from an empty sampler")
+
+        if self._remaining == 0:
+            self._remaining = self.n
+            self._swaps.clear()
+            self.epoch += 1
+
+        slot = random.randrange(self._remaining)
+        last = self._remaining - 1
+
+        idx = self._swaps.get(slot, slot)
+        # Move the index in the last undrawn slot into the one just drawn.
+        self._swaps[slot] = self._swaps.get(last, last)
+        self._swaps.pop(last, None)
+        self._remaining -= 1
+
+        return idx
+
+    def remaining(self):
+        return self._remaining
@@ -0,0 +1,106 @@
+import heapq
+import itertools
+import time
+
+# How long a word rests in each Leitner box before it is due again, in
+# seconds. A right answer moves a word up one box, a wrong one back to the
+# first.
+LEITNER_INTERVALS = [
+    60,                 # 1 minute
+    10 * 60,            # 10 minutes
+    60 * 60,            # 1 hour
+    24 * 60 * 60,       # 1 day
+    3 * 24 * 60 * 60,   # 3 days
+    7 * 24 * 60 * 60,   # 1 week
+    30 * 24 * 60 * 60,  # 1 month
+]
+
+class SpacedRepetitionScheduler:
+    '''
+    Leitner style scheduler that keeps the words seen so far in a min-heap of
+    due times. Picking the next word and rescheduling one are both O(log n).
+    Rescheduled words are pushed again rather than moved, and the outdated
+    heap entries are skipped when they come up.
+
+    Words that were never asked are pulled from new_key (a callable returning
+    an unseen key or None) whenever nothing is due, so the heap only ever
+    holds the words a learner has actually met.
+    '''
+    def __init__(self, new_key, intervals=LEITNER_INTERVALS, clock=time.time):
+        self._new_key = new_key
+        self._intervals = intervals
+        self._clock = clock
+
+        self._heap = []   # [(<due>, <seq>, <key>)]
+        self._cards = {}  # {<key>: [<box>, <due>, <seq>]}
+        self._seq = itertools.count()
+
+    def next_key(self):
+        now = self._clock()
+        self._drop_outdated()
+
+        if self._heap and self._heap[0][0] <= now:
+            key = self._heap[0][2]
+        else:
+            key = self._new_key()
+            if key is None:
+                if not self._heap:
+                    return None
+                # Everything has been seen and nothing is due yet, so ask the
+                # word that is due the soonest.
+                key = self._heap[0][2]
+
+        # Push the word back by its current interval straight away, so that
+        # it does not come up again before it is answered.
+        box = self._cards[key][0] if key in self._cards else 0
+        self._schedule(key, box, now)
+        return key
+
+    def review(self, key, correct, now=None):
+        if now is None:
+            now = self._clock()
+
+        box = self._cards[key][0] if key in self._cards else 0
+        box = min(box + 1, len(self._intervals) - 1) if correct else 0
+        self._schedule(key, box, now)
+
+    def cards(self):
+        return {key: card[:2] for key, card in self._cards.items()}
+
+    def restore(self, cards):
+        # Restores the boxes and due times saved with cards().
+        self._cards = {}
+        for key, (box, due) in cards.items():
+            self._cards[key] = [box, due, next(self._seq)]
+        self._heap = [(due, seq, key) for key, (_, due, seq) in self._cards.items()]
+        heapq.heapify(self._heap)
+
+    def due_count(self, now=None):
+        if now is None:
+            now = self._clock()
+        return sum(1 for _, due, _ in self._cards.values() if due <= now)
+
+    def __len__(self):
+        return len(self._cards)
+
+    def __contains__(self, key):
+        return key in self._cards
+
+    def _schedule(self, key, box, now):
+        due = now + self._intervals[box]
+        seq = next(self._seq)
+        self._cards[key] = [box, due, seq]
+        heapq.heappush(self._heap, (due, seq, key))
+
+        # Outdated entries are normally dropped as they reach the top; rebuild
+        # once they make up most of the heap so it stays O(n) in size.
+        if len(self._heap) > 2 * len(self._cards) + 64:
+            self._heap = [(due, seq, key) for key, (_, due, seq) in self._cards.items()]
+            heapq.heapify(self._heap)
+
+    def _drop_outdated(self):
+        while self._heap:
+            _, seq, key = self._heap[0]
+            if self._cards[key][2] == seq:
+                break
+            heapq.heappop(self._heap)
@@ -0,0 +1,204 @@
+import os
+import pickle
+import struct
+import sys
+import time
+
+import gevent
+from gevent import subprocess, Timeout
+from gevent.event import AsyncResult
+from gevent.queue import Queue, Empty
+
+import metrics
+from log import get_logger
+
+logger = get_logger()
+
+DEFAULT_WORKERS = os.cpu_count() or 1
+DEFAULT_TIMEOUT = 0.5  # seconds, waiting for a worker included
+DEFAULT_MAX_PENDING = 64  # calls waiting for a free worker
+
+# Seconds to wait before starting a worker again after it died, so that one
+# that cannot start at all does not keep the pool busy restarting it.
+RESTART_DELAY = 1.0
+
+_HEADER = struct.Struct(">I")
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.realpath(__file__)), "scoring_worker.py")
+
+SCORING_CALLS = metrics.Counter(
+    "spiel_scoring_pool_calls_total",
+    "Scoring calls sent to the worker pool, by result.", labels=["result"])
+SCORING_WORKERS = metrics.Gauge(
+    "spiel_scoring_pool_workers", "Scoring workers, by state.", labels=["state"])
+
+'''
+Scores answers in a pool of worker processes, so that spaCy's CPU bound work
+runs on every core and never holds up the gevent hub, which every request of
+this process shares. Every worker loads the model once and then answers
+(<id>, <semantic>, <pairs>) calls, one at a time, with the similarities
+find_similarities() computes, over its stdin and stdout (see
+scoring_worker.py).
+
+similarities() waits cooperatively and returns None instead of scores when
+the call could not be answered in time: every worker busy and max_pending
+calls already waiting, no reply within timeout seconds, or no worker up,
+e.g. while the model is still loading. Callers then score some cheaper way.
+
+Workers are started on first use, so that processes forked from this one
+start pools of their own instead of sharing pipes with the parent's workers.
+'''
+class ScoringPool:
+    def __init__(self, workers=DEFAULT_WORKERS, semantic=True, model=None,
+                 timeout=DEFAULT_TIMEOUT, max_pending=DEFAULT_MAX_PENDING):
+        self._size = workers
+        self._semantic = semantic
+        self._model = model
+        self.timeout = timeout
+        self.max_pending = max_pending
+
+        self._pid = None
+        self._workers = []
+        self._idle = None  # Queue of workers ready for a call.
+        self._pending = 0
+        self._next_id = 0
+        self._closed = False
+
+        SCORING_WORKERS.set_function(
+            lambda: self._idle.qsize() if self._pid == os.getpid() else 0, state="idle")
+        SCORING_WORKERS.set_function(
+            lambda: sum(w.busy for w in self._workers) if self._pid == os.getpid() else 0,
+            state="busy")
+
+    def start(self):
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._idle = Queue()
+        self._workers = [_Worker(self) for _ in range(self._size)]
+        for worker in self._workers:
+            worker.start()
+
+    def similarities(self, pairs, semantic=True):
+        self.start()
+        deadline = time.monotonic() + self.timeout
+
+        if self._idle.empty() and self._pending >= self.max_pending:
+            SCORING_CALLS.inc(result="saturated")
+            return None
+
+        self._pending += 1
+        try:
+            worker = self._idle.get(timeout=self.timeout)
+        except Empty:
+            SCORING_CALLS.inc(result="saturated")
+            return None
+        finally:
+            self._pending -= 1
+
+        self._next_id += 1
+        try:
+            result = worker.call(self._next_id, semantic, pairs)
+            scores = result.get(timeout=max(deadline - time.monotonic(), 0))
+        except Timeout:
+            # The worker goes back to the idle queue once its late reply is in.
+            SCORING_CALLS.inc(result="timeout")
+            return None
+        except Exception as e:
+            logger.warning(f"Scoring worker failed: {e}")
+            SCORING_CALLS.inc(result="error")
+            return None
+
+        SCORING_CALLS.inc(result="ok")
+        return scores
+
+    def close(self):
+        self._closed = True
+        if self._pid != os.getpid():
+            return
+        for worker in self._workers:
+            worker.stop()
+
+class _Worker:
+    def __init__(self, pool):
+        self._pool = pool
+        self._process = None
+        self._results = {}  # {<call id>: AsyncResult}
+        self.busy = False
+
+    def start(self):
+        gevent.spawn(self._run)
+
+    def _run(self):
+        while not self._pool._closed:
+            args = [sys.executable, WORKER_SCRIPT]
+            if self._pool._semantic:
+                args.append("--semantic")
+            if self._pool._model:
+                args.extend(["--model", self._pool._model])
+            self._process = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            try:
+                # The first message says the model is loaded.
+                read_message(self._process.stdout)
+                self._pool._idle.put(self)
+                while True:
+                    call_id, scores, error = read_message(self._process.stdout)
+                    self.busy = False
+                    result = self._results.pop(call_id, None)
+                    if result is not None:
+                        if error is None:
+                            result.set(scores)
+                        else:
+                            result.set_exception(Exception(error))
+                    self._pool._idle.put(self)
+            except (EOFError, OSError) as e:
+                if not self._pool._closed:
+                    logger.warning(f"Scoring worker {self._process.pid} exited: {e}")
+            finally:
+                self._forget()
+            gevent.sleep(RESTART_DELAY)
+
+    def call(self, call_id, semantic, pairs):
+        result = self._results[call_id] = AsyncResult()
+        self.busy = True
+        try:
+            write_message(self._process.stdin, (call_id, semantic, pairs))
+        except OSError:
+            self._results.pop(call_id, None)
+            raise
+        return result
+
+    def _forget(self):
+        # Fails the calls still waiting and takes this worker out of the
+        # idle queue, if it is in it.
+        self.busy = False
+        for result in self._results.values():
+            result.set_exception(EOFError("Scoring worker exited"))
+        self._results.clear()
+        idle = self._pool._idle
+        workers = [idle.get() for _ in range(idle.qsize())]
+        for worker in workers:
+            if worker is not self:
+                idle.put(worker)
+        if self._process is not None:
+            self._process.kill()
+            self._process.wait()
+
+    def stop(self):
+        if self._process is not None and self._process.poll() is None:
+            self._process.stdin.close()
+
+def write_message(file, message):
+    data = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+    file.write(_HEADER.pack(len(data)) + data)
+    file.flush()
+
+def read_message(file):
+    header = file.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        raise EOFError("Scoring worker closed its pipe")
+    (size,) = _HEADER.unpack(header)
+    data = file.read(size)
+    if len(data) < size:
+        raise EOFError("Scoring worker closed its pipe")
+    return pickle.loads(data)
@@ -0,0 +1,40 @@
+import os
+import sys
+
+from scoring_pool import read_message, write_message
+
+'''
+A scoring worker of ScoringPool. Loads the spaCy model once, says so, and
+then answers the calls read from stdin on stdout until stdin is closed.
+'''
+def serve(semantic, model=None):
+    # Anything printed goes to stderr, so that stdout only carries replies.
+    replies = os.fdopen(os.dup(sys.stdout.fileno()), 'wb')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    calls = sys.stdin.buffer
+
+    from spiel import SemanticComparator, find_similarities, SPACY_MODEL
+
+    if semantic:
+        SemanticComparator.load(model or SPACY_MODEL)
+    write_message(replies, "ready")
+
+    while True:
+        try:
+            call_id, semantic, pairs = read_message(calls)
+        except EOFError:
+            return
+        try:
+            write_message(replies, (call_id, find_similarities(pairs, semantic), None))
+        except Exception as e:
+            write_message(replies, (call_id, None, f"{type(e).__name__}: {e}"))
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Scoring worker, started by ScoringPool")
+    parser.add_argument('--semantic', action='store_true', help='Load the spaCy model')
+    parser.add_argument('--model', help='spaCy model to load')
+
+    args = parser.parse_args()
+    serve(args.semantic, args.model)
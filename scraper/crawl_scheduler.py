@@ -0,0 +1,208 @@
+import time
+
+import gevent
+from gevent.lock import BoundedSemaphore
+from gevent.pool import Group
+
+from log import get_logger
+
+logger = get_logger()
+
+DEFAULT_CRAWL_CONCURRENCY = 4
+DEFAULT_TRANSLATE_CONCURRENCY = 8
+
+# Requests per second and burst size of every upstream host, and of hosts not
+# listed here.
+DEFAULT_HOST_LIMITS = {
+    "www.dwds.de": (2.0, 4),
+    "api.deepl.com": (10.0, 10),
+}
+DEFAULT_HOST_LIMIT = (5.0, 5)
+
+# A throttled host gets half its rate, down to MIN_RATE_FACTOR of its limit,
+# and every request that goes through gives a twentieth of its limit back.
+SLOWDOWN_FACTOR = 0.5
+RECOVERY_STEP = 0.05
+MIN_RATE_FACTOR = 0.05
+
+DEFAULT_RETRIES = 5
+DEFAULT_REPORT_INTERVAL = 10.0  # seconds
+
+class Throttled(Exception):
+    '''
+    Raised by crawl and translate calls when the upstream answered 429 or 5xx,
+    with the seconds its Retry-After header asked for, if any.
+    '''
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+'''
+Token bucket of one upstream host: holds up to burst tokens, refilled at
+rate per second, and every request takes one. The rate drops when the host
+pushes back and creeps back up to the limit as requests go through again.
+'''
+class TokenBucket:
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+        self._tokens = float(burst)
+        self._updated = clock()
+        self._paused_until = 0.0
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        while True:
+            now = self._clock()
+            if now < self._paused_until:
+                gevent.sleep(self._paused_until - now)
+                continue
+            self._refill(now)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            gevent.sleep((1 - self._tokens) / self.rate)
+
+    def slow_down(self, retry_after=None):
+        self.rate = max(self.max_rate * MIN_RATE_FACTOR, self.rate * SLOWDOWN_FACTOR)
+        now = self._clock()
+        self._refill(now)
+        # Nothing goes out before the host said so, or for one request's
+        # worth of time at the new rate.
+        pause = retry_after if retry_after is not None else 1 / self.rate
+        self._paused_until = max(self._paused_until, now + pause)
+        self._tokens = 0
+
+    def recover(self):
+        self.rate = min(self.max_rate, self.rate + self.max_rate * RECOVERY_STEP)
+
+'''
+Runs the crawl and translate calls of a compile with at most
+crawl_concurrency and translate_concurrency of them in flight, and at most
+as many requests per second to every host as its token bucket allows.
+
+A call raising Throttled slows its host down and is retried, up to retries
+times; one that still fails, or raises anything else, is logged and
+results in None, as a failed greenlet would. crawl() and translate() return
+greenlets at once; join() waits for all of them.
+
+While calls are running, progress with throughput and an estimate of the
+time left is logged every report_interval seconds.
+'''
+class CrawlScheduler:
+    def __init__(self, crawl_concurrency=DEFAULT_CRAWL_CONCURRENCY,
+                 translate_concurrency=DEFAULT_TRANSLATE_CONCURRENCY,
+                 host_limits=DEFAULT_HOST_LIMITS, retries=DEFAULT_RETRIES,
+                 report_interval=DEFAULT_REPORT_INTERVAL):
+        self._slots = {
+            "crawl": BoundedSemaphore(crawl_concurrency),
+            "translate": BoundedSemaphore(translate_concurrency),
+        }
+        self._host_limits = host_limits
+        self._buckets = {}  # {<host>: TokenBucket}
+        self._retries = retries
+        self._report_interval = report_interval
+        self._group = Group()
+        self._reporter = None
+
+        self._started = None
+        self._stats = {kind: {"queued": 0, "done": 0, "failed": 0}
+                       for kind in self._slots}
+        self._throttled = {}  # {<host>: <times throttled>}
+
+    def crawl(self, host, fn, *args):
+        return self._spawn("crawl", host, fn, args)
+
+    def translate(self, host, fn, *args):
+        return self._spawn("translate", host, fn, args)
+
+    def bucket(self, host):
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            rate, burst = self._host_limits.get(host, DEFAULT_HOST_LIMIT)
+            bucket = self._buckets[host] = TokenBucket(rate, burst)
+        return bucket
+
+    def join(self, timeout=None):
+        # Returns False if calls are still running after timeout seconds.
+        if not self._group.join(timeout=timeout):
+            return False
+        if self._reporter is not None:
+            self._reporter.kill()
+            self._reporter = None
+        if self._started is not None:
+            self._report(final=True)
+        return True
+
+    def completed(self):
+        return sum(stats["done"] for stats in self._stats.values())
+
+    def _spawn(self, kind, host, fn, args):
+        if self._started is None:
+            self._started = time.monotonic()
+        if self._reporter is None and self._report_interval > 0:
+            self._reporter = gevent.spawn(self._report_periodically)
+        self._stats[kind]["queued"] += 1
+        return self._group.spawn(self._run, kind, host, fn, args)
+
+    def _run(self, kind, host, fn, args):
+        bucket = self.bucket(host)
+        with self._slots[kind]:
+            for _ in range(self._retries + 1):
+                bucket.acquire()
+                try:
+                    value = fn(*args)
+                except Throttled as e:
+                    self._throttled[host] = self._throttled.get(host, 0) + 1
+                    bucket.slow_down(e.retry_after)
+                    logger.warning(f"{host} throttled {kind} of {args} ({e}), "
+                                   f"slowing down to {bucket.rate:.2f} requests/s")
+                    continue
+                except Exception as e:
+                    logger.error(f"{kind} of {args} failed: {e}")
+                    break
+                bucket.recover()
+                self._stats[kind]["done"] += 1
+                return value
+            else:
+                logger.error(f"Giving up {kind} of {args} after {self._retries} retries")
+
+        self._stats[kind]["done"] += 1
+        self._stats[kind]["failed"] += 1
+        return None
+
+    def _report_periodically(self):
+        while True:
+            gevent.sleep(self._report_interval)
+            self._report()
+
+    def _report(self, final=False):
+        elapsed = max(time.monotonic() - self._started, 1e-9)
+        parts = []
+        for kind, stats in self._stats.items():
+            if stats["queued"] == 0:
+                continue
+            rate = stats["done"] / elapsed
+            left = stats["queued"] - stats["done"]
+            eta = f", {left / rate:.0f}s left" if rate > 0 and left > 0 else ""
+            parts.append(f"{kind} {stats['done']}/{stats['queued']} "
+                         f"({stats['failed']} failed, {rate:.2f}/s{eta})")
+        throttled = ", ".join(
+            f"{host} {count}x, now {self._buckets[host].rate:.2f}/s"
+            for host, count in self._throttled.items())
+        message = "; ".join(parts) + (f"; throttled: {throttled}" if throttled else "")
+        prefix = f"Done after {elapsed:.1f}s: " if final else "Progress: "
+        logger.info(prefix + message)
+
+    def stats(self):
+        return {
+            "elapsed": time.monotonic() - self._started if self._started is not None else 0.0,
+            "calls": {kind: dict(stats) for kind, stats in self._stats.items()},
+            "throttled": dict(self._throttled),
+            "rates": {host: bucket.rate for host, bucket in self._buckets.items()},
+        }
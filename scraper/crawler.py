@@ -1,16 +1,35 @@
+import codecs
 import requests
 import json
 import os
+import time
 
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
 
 from log import get_logger
+from scraper.crawl_scheduler import Throttled, DEFAULT_CRAWL_CONCURRENCY
+from scraper.jsonld import extract_json_ld
 import util
 
 logger = get_logger()
 
 SCRAPES_FOLDER_NAME = "scrapes"
 
+CONNECT_TIMEOUT = 5.0  # seconds
+READ_TIMEOUT = 20.0  # seconds
+
+# Answers that are worth retrying, as are timeouts and dropped connections.
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# The JSON-LD block of a DWDS page holding the entry (the first one describes
+# the site).
+JSON_LD_INDEX = 1
+
+CHUNK_SIZE = 16 * 1024  # bytes
+# What is left of a page after its JSON-LD is read and discarded, up to this
+# much, so that the connection can be reused; longer rests are cut off.
+MAX_DRAIN_BYTES = 256 * 1024
+
 class Crawler:
     def __init__(self):
         curr_dir = os.path.dirname(os.path.abspath(__file__))     
@@ -28,9 +47,71 @@ class Crawler:
     def crawl(self, word):
         pass
 
+    def log_crawl_stats(self):
+        pass
+
+'''
+Crawls DWDS over one keep-alive session, with a connection pool as large as
+the number of crawls the scheduler runs at once, so that every word after
+the first few reuses a connection instead of a TCP and TLS handshake.
+
+Requests time out, and 429s, server errors, timeouts and dropped connections
+raise Throttled with the Retry-After DWDS sent, if any. The crawl scheduler
+retries them, after slowing down all crawls of the host rather than this one
+only; nothing is retried here, so that every crawl makes at most as many
+requests as the scheduler allows. Every request is timed; see
+log_crawl_stats().
+'''
 class DWDSCrawler(Crawler):
     DWDS_URL_PREFIX = "https://www.dwds.de/wb/"
-    
+
+    def __init__(self, pool_size=DEFAULT_CRAWL_CONCURRENCY):
+        super().__init__()
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+
+        self._durations = []  # Seconds taken by every request.
+        self._stats = {"throttled": 0}
+
+    def _get(self, url):
+        start = time.perf_counter()
+        try:
+            response = self._session.get(
+                url, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), stream=True)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            self._durations.append(time.perf_counter() - start)
+            self._stats["throttled"] += 1
+            raise Throttled(f"Got {e} in {url}")
+        self._durations.append(time.perf_counter() - start)
+
+        if response.status_code in RETRY_STATUSES:
+            _release(response)
+            self._stats["throttled"] += 1
+            raise Throttled(f"Got return code {response.status_code} in {url}",
+                            _retry_after(response))
+        return response
+
+    def crawl_stats(self):
+        durations = sorted(self._durations)
+        stats = dict(self._stats, requests=len(durations))
+        if durations:
+            stats.update(
+                mean=sum(durations) / len(durations),
+                p50=durations[len(durations) // 2],
+                p95=durations[min(len(durations) - 1, int(len(durations) * 0.95))],
+                max=durations[-1])
+        return stats
+
+    def log_crawl_stats(self):
+        stats = self.crawl_stats()
+        message = f"DWDS -> Requests: {stats['requests']}, throttled: {stats['throttled']}"
+        if stats["requests"]:
+            message += (f", mean: {stats['mean'] * 1000:.0f} ms, p50: {stats['p50'] * 1000:.0f} ms, "
+                        f"p95: {stats['p95'] * 1000:.0f} ms, max: {stats['max'] * 1000:.0f} ms")
+        logger.info(message)
+
     def crawl(self, word):
         file_name = self._dump_file_name(word)
         if util.file_exists(file_name):
@@ -39,27 +120,29 @@ class DWDSCrawler(Crawler):
          
         # Step 1: Make HTTP Request
         url = DWDSCrawler._dwds_url(word)
-        response = requests.get(url)
+        response = self._get(url)
 
         if response.status_code != 200:
+            _release(response)
             logger.error(f"Got return code {response.status_code} in {url}")
             return None
             
-        # Step 2: Parse HTML Content
-        soup = BeautifulSoup(response.text, 'html.parser')
-
-        # Step 3: Find JSON-LD script tag
-        script_tags = soup.find_all('script', type='application/ld+json')
+        # Step 2 and 3: Find the JSON-LD script tag, reading the page only
+        # up to its end.
+        try:
+            json_ld, found = extract_json_ld(_text_chunks(response), JSON_LD_INDEX)
+        finally:
+            _release(response)
 
-        if len(script_tags) < 2:
-            logger.error(f"Found {len(script_tags)} in {url}")
+        if json_ld is None:
+            logger.error(f"Found {found} in {url}")
             return None
         
-        logger.debug(f"JSON+LD tags found for {word}: {script_tags}")
+        logger.debug(f"JSON+LD tag found for {word}: {json_ld}")
 
         # Step 4: Extract and Parse JSON Data
         try:
-            json_data = json.loads(script_tags[1].string)
+            json_data = json.loads(json_ld)
             
             # Write json data to dump file
             with open(file_name, 'w') as file:
@@ -82,10 +165,38 @@ class DWDSCrawler(Crawler):
     def _dwds_url(cls, word):
         return cls.DWDS_URL_PREFIX + word
 
+def _text_chunks(response):
+    # Decoded as response.text would, for the charset DWDS always sends.
+    decoder = codecs.getincrementaldecoder(response.encoding or "utf-8")(errors="replace")
+    for chunk in response.iter_content(CHUNK_SIZE):
+        yield decoder.decode(chunk)
+    yield decoder.decode(b"", final=True)
+
+def _release(response):
+    # Reads out what is left of a short page or error response, so that its
+    # connection goes back to the pool instead of being closed.
+    drained = 0
+    try:
+        for chunk in response.iter_content(CHUNK_SIZE):
+            drained += len(chunk)
+            if drained > MAX_DRAIN_BYTES:
+                break
+    except requests.RequestException:
+        pass
+    finally:
+        response.close()
+
+def _retry_after(response):
+    # Only the number of seconds form; DWDS does not send dates.
+    try:
+        return float(response.headers["Retry-After"])
+    except (KeyError, ValueError):
+        return None
+
 class CrawlerFactory:
     @classmethod
-    def get_crawler(cls, crawler_source):
+    def get_crawler(cls, crawler_source, **kwargs):
         if crawler_source.lower() == "dwds":
-            return DWDSCrawler()
+            return DWDSCrawler(**kwargs)
         else:
             raise ValueError(f"Invalid translator source type {crawler_source}")
@@ -0,0 +1,74 @@
+from html.parser import HTMLParser
+
+JSON_LD_TYPE = "application/ld+json"
+
+class _Done(Exception):
+    pass
+
+'''
+Finds the <script type="application/ld+json"> blocks of an HTML page fed to
+it piece by piece, without building a tree of the page. It tokenizes with
+the same parser as BeautifulSoup's 'html.parser' builder, so it finds the
+same blocks with the same text as soup.find_all('script',
+type='application/ld+json') and .string would, and stops tokenizing as soon
+as block number index (counting from 0) is complete.
+'''
+class JsonLdExtractor(HTMLParser):
+    def __init__(self, index):
+        # Character references are left alone, as BeautifulSoup does.
+        super().__init__(convert_charrefs=False)
+        self.index = index
+        self.found = 0  # Blocks completed so far.
+        self.text = None  # Text of block number index, once found.
+        self._block = None  # Text pieces of the block being read.
+
+    def handle_starttag(self, tag, attrs):
+        # Like BeautifulSoup, the last of repeated attributes wins.
+        if tag == "script" and dict(attrs).get("type") == JSON_LD_TYPE:
+            self._block = []
+
+    def handle_data(self, data):
+        if self._block is not None:
+            self._block.append(data)
+
+    def handle_endtag(self, tag):
+        if tag == "script" and self._block is not None:
+            self._end_block()
+
+    def _end_block(self):
+        if self.found == self.index:
+            self.text = "".join(self._block)
+        self.found += 1
+        self._block = None
+        if self.text is not None:
+            raise _Done()
+
+    def feed(self, data):
+        # Returns True once the block has been found; feed no more then.
+        try:
+            super().feed(data)
+        except _Done:
+            return True
+        return False
+
+    def close(self):
+        super().close()
+        # Like BeautifulSoup, a block still open at the end of the page counts
+        # but has no text.
+        if self._block is not None:
+            self.found += 1
+            self._block = None
+
+def extract_json_ld(chunks, index=0):
+    '''
+    Returns the text of JSON-LD block number index of the page made of the
+    text chunks, reading no more of them than it takes, and the number of
+    blocks found, which is index + 1 unless there are fewer.
+    '''
+    extractor = JsonLdExtractor(index)
+    for chunk in chunks:
+        if extractor.feed(chunk):
+            break
+    else:
+        extractor.close()
+    return extractor.text, extractor.found
@@ -1,6 +1,7 @@
 import deepl
 
 from log import get_logger
+from scraper.crawl_scheduler import Throttled
 
 logger = get_logger()
 
@@ -49,7 +50,7 @@ class DeeplTranslator(Translator):
     
     def translate_from_deutsch(self, german_text):
         # Translate the German text to English
-        response = self._translator.translate_text(
+        response = self._translate_text(
             source_lang="de", target_lang="en-us", text=german_text)
         
         self._de_to_en_texts.append(german_text)
@@ -59,7 +60,7 @@ class DeeplTranslator(Translator):
     
     def translate_from_englisch(self, english_text):
         # Translate the English text to German
-        response = self._translator.translate_text(
+        response = self._translate_text(
             source_lang="en", target_lang="de", text=english_text)
         
         self._en_to_de_texts.append(english_text)
@@ -67,6 +68,18 @@ class DeeplTranslator(Translator):
 
         return response.text
 
+    def _translate_text(self, **kwargs):
+        # Rate limits and server errors are left to the crawl scheduler to
+        # slow down and retry.
+        try:
+            return self._translator.translate_text(**kwargs)
+        except deepl.TooManyRequestsException as e:
+            raise Throttled(str(e)) from e
+        except deepl.DeepLException as e:
+            if e.http_status_code is not None and e.http_status_code >= 500:
+                raise Throttled(str(e)) from e
+            raise
+
 MOCK_RESPONSE_TEXT = None
 class MockTranslator(Translator):      
     def _init(self, api_key):
@@ -0,0 +1,189 @@
+from array import array
+from bisect import bisect_left
+import heapq
+import math
+import re
+
+from log import get_logger
+from lookup_index import fold
+
+logger = get_logger()
+
+DEFAULT_RESULTS = 20
+PHRASE_BONUS = 2.0
+# BM25's term frequency saturation and length normalisation.
+BM25_K1 = 1.2
+BM25_B = 0.75
+MAX_POSITIONS = 1 << 16  # Tokens per sentence that are indexed.
+
+LANGUAGES = ["de", "en"]
+
+_TOKEN_RE = re.compile(r"\w+")
+
+def tokenize(text):
+    '''
+    Returns the (folded token, start, end) triples of a sentence, with start
+    and end the character offsets of the token in the original text. Anything
+    but a string, like a translation that never came, has no tokens.
+    '''
+    if not isinstance(text, str):
+        return []
+    return [(fold(m.group()), m.start(), m.end()) for m in _TOKEN_RE.finditer(text)]
+
+class SearchIndex:
+    '''
+    Inverted index over the example sentences of a deck, German and English
+    alike. Every sentence is one document, and every folded token maps to the
+    sorted ids of the documents containing it and the positions of the token
+    within each of them, so a query only touches the postings of its own
+    tokens and never has to read a sentence back to rank it.
+
+    A document matches when it contains all tokens of the query. Matches are
+    ranked by BM25, which weighs every query token by its idf and by how
+    often it occurs in the document relative to the document's length, plus
+    a bonus when the tokens also appear next to each other in the order they
+    were asked for.
+
+    Documents and postings are kept in typed arrays rather than lists of
+    ints: they take a fraction of the memory, and reading them does not
+    touch any object's reference count, so processes forked after the index
+    was built keep sharing its pages.
+    '''
+    def __init__(self, deck):
+        self._deck = deck
+        # Per doc: the entry, the example within it and its language.
+        self._doc_entries = array('I')
+        self._doc_examples = array('H')
+        self._doc_languages = array('B')
+        self._lengths = array('I')  # Number of tokens per doc.
+        # {<token>: (<doc ids>, <ends>, <positions>)}: the docs containing
+        # the token, in order, and its positions in them, those of the i-th
+        # doc being positions[ends[i - 1]:ends[i]].
+        self._postings = {}
+
+        for idx in range(len(deck)):
+            for example_idx, example in enumerate(deck.examples(idx)):
+                for lang_idx, sentence in enumerate(example[:len(LANGUAGES)]):
+                    # Examples whose translation is missing only index the
+                    # sentence they have.
+                    if not isinstance(sentence, str):
+                        continue
+                    doc_id = len(self._lengths)
+                    self._doc_entries.append(idx)
+                    self._doc_examples.append(example_idx)
+                    self._doc_languages.append(lang_idx)
+                    sentence_tokens = tokenize(sentence)
+                    self._lengths.append(len(sentence_tokens))
+
+                    token_positions = {}
+                    # Positions are kept in 16 bits; nothing past that is
+                    # found.
+                    for position, (token, _, _) in enumerate(sentence_tokens[:MAX_POSITIONS]):
+                        token_positions.setdefault(token, []).append(position)
+                    for token, positions in token_positions.items():
+                        postings = self._postings.get(token)
+                        if postings is None:
+                            postings = self._postings[token] = (
+                                array('I'), array('I'), array('H'))
+                        docs, ends, all_positions = postings
+                        docs.append(doc_id)
+                        all_positions.extend(positions)
+                        ends.append(len(all_positions))
+
+        self._average_length = sum(self._lengths) / max(len(self._lengths), 1)
+
+        logger.debug(
+            f"Built search index over {len(self._lengths)} sentences and "
+            f"{len(self._postings)} tokens.")
+
+    def search(self, query, limit=DEFAULT_RESULTS):
+        import numpy as np
+
+        tokens = [t for t, _, _ in tokenize(query)]
+        if not tokens:
+            return []
+
+        postings = {}
+        for token in tokens:
+            if token not in postings:
+                postings[token] = self._postings.get(token)
+                if postings[token] is None:
+                    return []
+
+        # Intersect starting from the rarest token.
+        by_rarity = sorted(postings.values(), key=lambda p: len(p[0]))
+        matches = _as_numpy(by_rarity[0][0])
+        for docs, _, _ in by_rarity[1:]:
+            matches = np.intersect1d(matches, _as_numpy(docs), assume_unique=True)
+            if matches.size == 0:
+                return []
+
+        # BM25 of every match, in one pass per query token.
+        lengths = _as_numpy(self._lengths)[matches]
+        length_norm = 1 - BM25_B + BM25_B * lengths / self._average_length
+        scores = np.zeros(matches.size)
+        for docs, ends, _ in postings.values():
+            ends = _as_numpy(ends)
+            i = np.searchsorted(_as_numpy(docs), matches)
+            tf = ends[i] - np.where(i > 0, ends[i - 1], 0)
+            scores += self._idf(docs) * tf * (BM25_K1 + 1) / (tf + BM25_K1 * length_norm)
+
+        if len(tokens) > 1:
+            scores += PHRASE_BONUS * self._contains_phrase(matches, tokens, postings)
+
+        # Best first, shorter sentences first among equal scores.
+        top = np.lexsort((matches, lengths, -scores))[:limit]
+
+        results = []
+        for j in top.tolist():
+            idx, example_idx, lang_idx = self._doc(int(matches[j]))
+            example = self._deck.examples(idx)[example_idx]
+            highlights = [[start, end] for token, start, end in tokenize(example[lang_idx])
+                          if token in postings]
+            results.append({
+                "word": self._deck.word(idx),
+                "example": example,
+                "language": LANGUAGES[lang_idx],
+                "highlights": highlights,
+                "score": round(float(scores[j]), 4)
+            })
+        return results
+
+    def __len__(self):
+        return len(self._lengths)
+
+    def _doc(self, doc_id):
+        return (self._doc_entries[doc_id], self._doc_examples[doc_id],
+                self._doc_languages[doc_id])
+
+    def _contains_phrase(self, matches, phrase, postings):
+        # Whether the tokens of phrase follow each other somewhere in each of
+        # the matching docs. Every occurrence of the i-th token of phrase
+        # becomes a (doc, position - i) key; a doc contains the phrase where
+        # a key is shared by all of its tokens.
+        import numpy as np
+
+        shared = None
+        for i, token in enumerate(phrase):
+            docs, ends, positions = (_as_numpy(a) for a in postings[token])
+            j = np.searchsorted(docs, matches)
+            stop = ends[j].astype(np.int64)
+            start = np.where(j > 0, ends[j - 1], 0).astype(np.int64)
+            counts = stop - start
+            # Indexes of the positions of the token in every matching doc.
+            first = np.repeat(start - (np.cumsum(counts) - counts), counts)
+            occurrences = first + np.arange(int(counts.sum()))
+            keys = (np.repeat(matches.astype(np.int64), counts) << 17) + (
+                positions[occurrences].astype(np.int64) + len(phrase) - i)
+            shared = keys if shared is None else np.intersect1d(shared, keys)
+        return np.isin(matches, np.unique(shared >> 17))
+
+    def _idf(self, docs):
+        # BM25's idf, which stays positive for tokens in most documents.
+        n = len(self._lengths)
+        return math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+
+def _as_numpy(values):
+    # A read-only numpy view of a typed array, without copying it.
+    import numpy as np
+    return np.frombuffer(values, dtype=values.typecode)
@@ -0,0 +1,263 @@
+from gevent import monkey
+monkey.patch_all()
+
+import os, sys
+sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+
+import signal
+import socket
+
+import gevent
+from gevent.lock import Semaphore
+from gevent.pywsgi import WSGIHandler, WSGIServer
+from werkzeug.wsgi import ClosingIterator
+
+from log import get_logger
+# Imported by its top level name, like app does, so both share one registry.
+import metrics
+
+from .app import create_app
+
+logger = get_logger()
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 5000
+DEFAULT_POOL_SIZE = 1000  # open connections, idle keep-alive ones included
+DEFAULT_MAX_CONCURRENT_REQUESTS = 32
+DEFAULT_MAX_QUEUED_REQUESTS = 128
+DEFAULT_QUEUE_TIMEOUT = 1.0  # seconds
+DEFAULT_DRAIN_TIMEOUT = 10.0  # seconds
+DEFAULT_BACKLOG = 256
+
+RETRY_AFTER = 1  # seconds
+
+# Never queued or shed, so that the server can still be watched while it is
+# overloaded.
+UNLIMITED_PATHS = ("/metrics",)
+
+_OVERLOADED_RESPONSE = (
+    b"HTTP/1.1 503 Service Unavailable\r\n"
+    b"Content-Type: text/plain; charset=utf-8\r\n"
+    b"Content-Length: 20\r\n"
+    b"Retry-After: " + str(RETRY_AFTER).encode() + b"\r\n"
+    b"Connection: close\r\n\r\n"
+    b"Server overloaded.\r\n")
+
+REQUESTS_SHED = metrics.Counter(
+    "spiel_http_requests_shed_total",
+    "Requests answered with 503 because the server was at capacity, by reason.",
+    labels=["reason"])
+CONNECTIONS = metrics.Gauge("spiel_http_connections", "Open client connections.")
+IN_FLIGHT = metrics.Gauge("spiel_http_requests_in_flight", "Requests being answered.")
+QUEUED = metrics.Gauge("spiel_http_requests_queued", "Requests waiting to be answered.")
+
+'''
+WSGI middleware capping how many requests the app answers at once. Requests
+share one gevent hub, so answering more of them at a time does not answer
+them any faster; it only makes every one of them slower. Up to
+max_concurrent requests run, up to max_queued more wait their turn, in
+order, for at most queue_timeout seconds, and everything beyond that is
+answered with a 503 straight away, so the latency of the requests that are
+let in stays bounded during a burst.
+
+While the server drains, responses carry Connection: close, so clients do
+not send more requests over connections that are about to go away.
+'''
+class LoadShedder:
+    def __init__(self, app, max_concurrent=DEFAULT_MAX_CONCURRENT_REQUESTS,
+                 max_queued=DEFAULT_MAX_QUEUED_REQUESTS, queue_timeout=DEFAULT_QUEUE_TIMEOUT):
+        self.app = app
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.draining = False
+        self._slots = Semaphore(max_concurrent)
+        self._queued = 0
+
+        IN_FLIGHT.set_function(self.in_flight)
+        QUEUED.set_function(lambda: self._queued)
+
+    def in_flight(self):
+        return self.max_concurrent - self._slots.counter
+
+    def __call__(self, environ, start_response):
+        if self.draining:
+            start_response = self._closing(start_response)
+        if environ.get("PATH_INFO") in UNLIMITED_PATHS:
+            return self.app(environ, start_response)
+
+        if self._slots.locked():
+            if self._queued >= self.max_queued:
+                return self._shed(start_response, "queue_full")
+            self._queued += 1
+            try:
+                admitted = self._slots.acquire(timeout=self.queue_timeout)
+            finally:
+                self._queued -= 1
+            if not admitted:
+                return self._shed(start_response, "queue_timeout")
+        else:
+            self._slots.acquire()
+
+        try:
+            # The slot is held until the body has been sent.
+            return ClosingIterator(self.app(environ, start_response), self._slots.release)
+        except:
+            self._slots.release()
+            raise
+
+    def _closing(self, start_response):
+        def closing_start_response(status, headers, exc_info=None):
+            headers = [(k, v) for k, v in headers if k.lower() != "connection"]
+            headers.append(("Connection", "close"))
+            return start_response(status, headers, exc_info)
+        return closing_start_response
+
+    def _shed(self, start_response, reason):
+        REQUESTS_SHED.inc(reason=reason)
+        start_response("503 Service Unavailable", [
+            ("Content-Type", "text/plain; charset=utf-8"),
+            ("Retry-After", str(RETRY_AFTER)),
+            ("Connection", "close")])
+        return [b"Server overloaded.\r\n"]
+
+class _Handler(WSGIHandler):
+    # Tells the server which connections are in the middle of a request.
+    def handle_one_response(self):
+        self.server.busy.add(self.socket)
+        try:
+            return super().handle_one_response()
+        finally:
+            self.server.busy.discard(self.socket)
+
+'''
+gevent's WSGI server with a bounded pool of connection greenlets.
+
+Once pool_size connections are open, new ones get a canned 503 instead of
+waiting in the listen backlog, where they would pile up unseen. Accepted
+sockets get TCP_NODELAY: the handler writes headers and body separately, and
+with Nagle's algorithm the body of every response but the first on a
+keep-alive connection waits for the client's delayed ACK, about 40 ms.
+
+drain() stops accepting, closes idle keep-alive connections, lets the
+requests in flight finish for up to drain_timeout seconds and makes
+serve_forever() return.
+'''
+class SpielServer(WSGIServer):
+    def __init__(self, listener, application, pool_size=DEFAULT_POOL_SIZE,
+                 drain_timeout=DEFAULT_DRAIN_TIMEOUT, **kwargs):
+        kwargs.setdefault("handler_class", _Handler)
+        super().__init__(listener, application, spawn=pool_size, **kwargs)
+        self.stop_timeout = drain_timeout
+        self.connections = set()
+        self.busy = set()
+
+        CONNECTIONS.set_function(lambda: len(self.connections))
+
+    def set_spawn(self, spawn):
+        super().set_spawn(spawn)
+        # The pool's full() would make the server stop accepting when the
+        # pool is full; keep accepting, and turn the extra connections away.
+        self.__dict__.pop("full", None)
+
+    def do_handle(self, *args):
+        if self.pool is not None and self.pool.full():
+            REQUESTS_SHED.inc(reason="connections")
+            # Not from the pool, and only for as long as it takes to answer.
+            gevent.spawn(self._reject, args[0])
+            return
+        super().do_handle(*args)
+
+    def _reject(self, client_socket):
+        try:
+            client_socket.settimeout(1)
+            # Read the request first, or closing the socket with it unread
+            # could reset the connection before the client sees the 503.
+            client_socket.recv(65536)
+            client_socket.sendall(_OVERLOADED_RESPONSE)
+            client_socket.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+        finally:
+            client_socket.close()
+
+    def handle(self, client_socket, address):
+        if client_socket.family in (socket.AF_INET, socket.AF_INET6):
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.connections.add(client_socket)
+        try:
+            super().handle(client_socket, address)
+        finally:
+            self.connections.discard(client_socket)
+
+    def drain(self):
+        if self.closed:
+            return
+        logger.info(f"Draining {len(self.busy)} requests in flight "
+                    f"(at most {self.stop_timeout}s).")
+        if isinstance(self.application, LoadShedder):
+            self.application.draining = True
+        # Closing the listener wakes serve_forever(), which then waits for
+        # the pool to empty.
+        self.close()
+        for client_socket in self.connections - self.busy:
+            try:
+                client_socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+def create_server(app=None, host=DEFAULT_HOST, port=DEFAULT_PORT, pool_size=DEFAULT_POOL_SIZE,
+                  max_concurrent=DEFAULT_MAX_CONCURRENT_REQUESTS,
+                  max_queued=DEFAULT_MAX_QUEUED_REQUESTS, queue_timeout=DEFAULT_QUEUE_TIMEOUT,
+                  drain_timeout=DEFAULT_DRAIN_TIMEOUT, backlog=DEFAULT_BACKLOG, log="default"):
+    '''
+    Returns a SpielServer for app (create_app() by default) on host:port,
+    behind a LoadShedder, that drains on SIGTERM and SIGINT.
+    '''
+    if app is None:
+        app = create_app()
+    server = SpielServer(
+        (host, port), LoadShedder(app, max_concurrent, max_queued, queue_timeout),
+        pool_size=pool_size, drain_timeout=drain_timeout, backlog=backlog, log=log)
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        gevent.signal_handler(signum, server.drain)
+    return server
+
+if __name__ == "__main__":
+    import argparse
+
+    # Run as a module of the package, e.g. python -m spiel.server, for the
+    # relative imports of the app.
+    parser = argparse.ArgumentParser(description="Serve the app on gevent's WSGI server")
+    parser.add_argument('--host', default=os.environ.get("SPIEL_HOST", DEFAULT_HOST),
+                        help='Address to listen on')
+    parser.add_argument('--port', type=int, default=int(os.environ.get("SPIEL_PORT", DEFAULT_PORT)),
+                        help='Port to listen on')
+    parser.add_argument('--pool-size', type=int,
+                        default=int(os.environ.get("SPIEL_POOL_SIZE", DEFAULT_POOL_SIZE)),
+                        help='Open connections, beyond which new ones get a 503')
+    parser.add_argument('--max-concurrent-requests', type=int,
+                        default=int(os.environ.get("SPIEL_MAX_CONCURRENT_REQUESTS", DEFAULT_MAX_CONCURRENT_REQUESTS)),
+                        help='Requests answered at once')
+    parser.add_argument('--max-queued-requests', type=int,
+                        default=int(os.environ.get("SPIEL_MAX_QUEUED_REQUESTS", DEFAULT_MAX_QUEUED_REQUESTS)),
+                        help='Requests waiting for their turn, beyond which new ones get a 503')
+    parser.add_argument('--queue-timeout', type=float,
+                        default=float(os.environ.get("SPIEL_QUEUE_TIMEOUT", DEFAULT_QUEUE_TIMEOUT)),
+                        help='Seconds a request waits for its turn before it gets a 503')
+    parser.add_argument('--drain-timeout', type=float,
+                        default=float(os.environ.get("SPIEL_DRAIN_TIMEOUT", DEFAULT_DRAIN_TIMEOUT)),
+                        help='Seconds given to requests in flight on SIGTERM')
+    parser.add_argument('--backlog', type=int, default=int(os.environ.get("SPIEL_BACKLOG", DEFAULT_BACKLOG)),
+                        help='Listen backlog')
+    parser.add_argument('--no-access-log', action='store_true', help='Do not log every request')
+
+    args = parser.parse_args()
+    server = create_server(
+        host=args.host, port=args.port, pool_size=args.pool_size,
+        max_concurrent=args.max_concurrent_requests, max_queued=args.max_queued_requests,
+        queue_timeout=args.queue_timeout, drain_timeout=args.drain_timeout,
+        backlog=args.backlog, log=None if args.no_access_log else "default")
+    logger.info(f"Serving on {args.host}:{args.port}")
+    server.serve_forever()
+    logger.info("Stopped.")
@@ -0,0 +1,42 @@
+from log import get_logger
+from util import LRUCache
+
+logger = get_logger()
+
+DEFAULT_MAX_SESSIONS = 1000
+DEFAULT_SESSION_TTL = 6 * 60 * 60  # seconds
+
+class SessionStore:
+    '''
+    Keeps one question cursor per learner so that every browser gets its own
+    serial and random streams over the shared deck. A cursor only holds the
+    positions of its next-iterators, never a copy of the words, so the store
+    is capped by number of learners; idle learners are dropped after ttl
+    seconds and the least recently seen ones once max_sessions is reached.
+    '''
+    def __init__(self, new_cursor, max_sessions=DEFAULT_MAX_SESSIONS,
+                 ttl=DEFAULT_SESSION_TTL):
+        self._new_cursor = new_cursor
+        self._cursors = LRUCache(max_sessions, ttl=ttl)
+
+    def get(self, learner_id):
+        cursor = self._cursors.get(learner_id)
+        if cursor is None:
+            logger.debug(f"Creating question cursor for learner {learner_id}")
+            cursor = self._new_cursor()
+        # Put back on every access so that the ttl counts from the last
+        # question asked rather than the first.
+        self._cursors.put(learner_id, cursor)
+        return cursor
+
+    def peek(self, learner_id):
+        # The learner's cursor if there is one; never creates one.
+        if learner_id is None:
+            return None
+        return self._cursors.get(learner_id)
+
+    def drop(self, learner_id):
+        self._cursors.pop(learner_id)
+
+    def __len__(self):
+        return len(self._cursors)
@@ -1,31 +1,59 @@
 from gevent import monkey
 monkey.patch_all()
 
-from colorama import Back, Fore, Style
+import atexit
+import gc
 import json
 import math
-from numpy import polyfit
 import os
 import random
+import time
 
+from deck import DECK_FILE_NAME
+from deck_snapshot import DeckSnapshot, DeckWatcher, DEFAULT_RELOAD_INTERVAL
 import gs_reader
+from journal import ScoreJournal
 from log import get_logger, update_logging_level
-from translation_compiler import Compiler, DUMP_FILE_NAME, DEEPL_KEY_VAR
+from lookup_index import DEFAULT_SUGGESTIONS
+import metrics
+from search_index import DEFAULT_RESULTS
+from ranking import DifficultyRanking
+from sampler import PermutationSampler
+from scheduler import SpacedRepetitionScheduler
+from scoring_pool import ScoringPool
+from translation_compiler import DUMP_FILE_NAME, DEEPL_KEY_VAR
 import util
 
 logger = get_logger()
 
+QUESTIONS_SERVED = metrics.Counter(
+    "spiel_questions_total", "Questions served, by mode.", labels=["mode"])
+ANSWERS_SCORED = metrics.Counter(
+    "spiel_answers_scored_total", "Answers scored, by result.", labels=["result"])
+DECK_ENTRIES = metrics.Gauge(
+    "spiel_deck_entries", "Entries in the loaded deck, by kind.", labels=["kind"])
+DECK_RELOADS = metrics.Counter(
+    "spiel_deck_reloads_total", "Times the deck was reloaded after its files changed.")
+
 SCORE_FILE_NAME = "_scores.txt"
 PREPOSITIONS_FILE_NAME = "_prepositions.txt"
 
 GS_SHEET_NAME = "Vokabeln und Phrasen"
 
+# Modes picked from when no mode is asked for in multi mode.
+MULTIMODE_MODES = ["word", "preposition"]
+
+# Modes that only decide the order of another mode's questions.
+QUESTION_TYPES = {"due": "word"}
+
 class DeutschesSpiel:
     def __init__(self, reload=False, use_semantic=False, use_multimode=False,
-                 serial=False, mode=None, start=None):
+                 serial=False, mode=None, start=None, shared_deck=False,
+                 shared_deck_dir=None, scoring_workers=0):
         self.SPIEL_MODES = {
             "word": self._get_next_spiel_word,
-            "preposition": self._get_next_preposition
+            "preposition": self._get_next_preposition,
+            "due": self._get_next_due_word
         }        
         
         self._reload = reload
@@ -34,24 +62,42 @@ class DeutschesSpiel:
         self._serial = serial
         self._mode = mode
         self._start = start
+        self._shared_deck = shared_deck
+        self._shared_deck_dir = shared_deck_dir
+        
+        # Answers are scored in worker processes when there are any, and the
+        # model is only loaded there.
+        self._scoring_pool = None
+        if scoring_workers > 0:
+            self._scoring_pool = ScoringPool(scoring_workers, semantic=use_semantic)
         
-        self._rows = {}  # {"word":<word>, "de_to_en":<>, "translation":<>,...}
-        self._spiel_dict = {} # {<word>: <original word entry>}
+        # Words, prepositions and their indexes. Replaced as a whole when the
+        # files change (see watch_deck), so every method reads it once and
+        # sticks to that snapshot.
+        self._deck = None
+        self._deck_watcher = None
         
-        self._prepositions = []
+        self._basic_scores = {}  # {<word>:(<rights>, <attempts>)}
         
-        self._basic_scores = {}  # {<word>:[90.0, 45.0,...]}
+        self._ranking = DifficultyRanking()
         
-        self._sorted_words = []
+        # Due dates of the game's own cursor, kept in the journal; cursors
+        # made for other learners get schedulers of their own.
+        self._scheduler = self._new_scheduler()
+        
+        self._journal = ScoreJournal()
         
         self._mode_handlers = {}
         
         self._init()
 
+        DECK_ENTRIES.set_function(lambda: len(self._deck.rows), kind="words")
+        DECK_ENTRIES.set_function(lambda: len(self._deck.prepositions), kind="prepositions")
+
     def _init(self):
         print("Initialising game...\n\n")
         
-        if not util.file_exists(DUMP_FILE_NAME):
+        if not util.file_exists(DUMP_FILE_NAME) and not util.file_exists(DECK_FILE_NAME):
             api_key = None
             # Check if the environment variable exists
             if DEEPL_KEY_VAR in os.environ:
@@ -60,84 +106,208 @@ class DeutschesSpiel:
             else:
                 exit(f"The environment variable {DEEPL_KEY_VAR} is not set.")
                           
+            from translation_compiler import Compiler
             compiler = Compiler(api_key)
             compiler.scrape_new(self._reload)
             
             if not util.file_exists(DUMP_FILE_NAME):
                 exit("No dump file found and could not create one inline.")
             
-        with open(DUMP_FILE_NAME, 'r') as file:
-            logger.debug(f"Loading entries from current dump file.")
-            self._rows = json.load(file)
-
-            self._spiel_dict = {}
-            for entry in self._rows:
-                word = entry["word"]
-                self._spiel_dict[word.lower()] = entry            
+        self._init_prepositions()
+        
+        self._deck = self._load_deck()
             
-        if util.file_exists(SCORE_FILE_NAME):
-            with open(SCORE_FILE_NAME, 'r') as file:
-                logger.debug(f"Loading entries from scores dump file.")
-                self._basic_scores = json.load(file)
-        else:
-            logger.debug("No scores file found.")
+        self._load_scores()
         
-        for k, v in self.SPIEL_MODES.items():
-            self._mode_handlers[k] = {
-                "random": v(serial=False),
-                "serial": v(serial=True)
-            }
+        self._mode_handlers = self.new_cursor(self._scheduler)
         
-        self._init_prepositions()
+        if self._use_semantic and self._scoring_pool is None:
+            if not SemanticComparator.is_loaded():
+                SemanticComparator.load()
+            self._index_translations(self._deck)
                 
         self._prepare_game()        
     
+    def _load_scores(self):
+        state, records = self._journal.load()
+        if state is not None:
+            logger.debug(f"Loading entries from scores snapshot.")
+            self._basic_scores = state["scores"]
+            self._ranking = DifficultyRanking.from_sums(state["trends"])
+            self._scheduler.restore(state["schedule"])
+        elif util.file_exists(SCORE_FILE_NAME):
+            # Scores saved before there was a journal.
+            with open(SCORE_FILE_NAME, 'r') as file:
+                logger.debug(f"Loading entries from scores dump file.")
+                self._basic_scores = json.load(file)
+        else:
+            logger.debug("No scores file found.")
+
+        for record in records:
+            self._apply_score(record["key"], record["score"], record["time"])
+        # Processes forked from an earlier run left their records to compact.
+        if self._journal.needs_compaction():
+            self._journal.compact(self._score_state())
+
+    def _score_state(self):
+        # Copies, so that the journal can serialise them while scores go on.
+        return {
+            "scores": dict(self._basic_scores),
+            "trends": self._ranking.sums(),
+            "schedule": self._scheduler.cards()
+        }
+
     def _init_prepositions(self):
         if not util.file_exists(PREPOSITIONS_FILE_NAME):
-            self._prepositions = gs_reader.fetch_from_gsheet(
+            prepositions = gs_reader.fetch_from_gsheet(
                 GS_SHEET_NAME, "Prepositions")
             
             with open(PREPOSITIONS_FILE_NAME, 'w') as file:
                 logger.debug(f"Dumping prepositions to file.")
-                json.dump(self._prepositions, file)
-        else:
-            with open(PREPOSITIONS_FILE_NAME, 'r') as file:
-                self._prepositions = json.load(file)
+                json.dump(prepositions, file)
+
+    def _load_deck(self):
+        return DeckSnapshot.load(
+            DUMP_FILE_NAME, PREPOSITIONS_FILE_NAME,
+            shared=self._shared_deck, shared_dir=self._shared_deck_dir)
+
+    '''
+    Gets the game ready to be shared by processes forked from this one:
+    builds every index up front, so that workers start with them instead of
+    each building its own, and moves everything allocated so far out of the
+    garbage collector's reach, so that collections in the workers do not
+    write to (and thereby copy) the pages they share.
+    '''
+    def prepare_for_fork(self):
+        self._deck.warm()
+        gc.collect()
+        gc.freeze()
+        # Frozen objects would otherwise only be torn down with the modules
+        # they refer to, after logging and gevent are already gone.
+        atexit.register(gc.unfreeze)
+
+    def _index_translations(self, deck):
+        SemanticComparator.index_translations(
+            deck.rows[idx]["translation"] for idx in range(len(deck.rows)))
+
+    '''
+    Reloads the words and prepositions whenever their files change, checking
+    every interval seconds in the background. Questions, lookups and cursors
+    move over to the new deck as it is swapped in; anything already running
+    finishes on the old one.
+    '''
+    def watch_deck(self, interval=DEFAULT_RELOAD_INTERVAL):
+        if self._deck_watcher is not None:
+            return
+        self._deck_watcher = DeckWatcher(
+            self._load_deck,
+            [DUMP_FILE_NAME, DECK_FILE_NAME, PREPOSITIONS_FILE_NAME],
+            self._swap_deck,
+            interval=interval,
+            prepare=self._prepare_deck)
+        self._deck_watcher.start()
+
+    def _prepare_deck(self, deck):
+        # Runs off the hub (see DeckWatcher): builds what the current deck
+        # has built, and embeds the translations of the new one.
+        deck.warm_like(self._deck)
+        if self._use_semantic and self._scoring_pool is None:
+            return SemanticComparator.embed_translations(
+                deck.rows[idx]["translation"] for idx in range(len(deck.rows)))
+        return None
+
+    def _swap_deck(self, deck, translation_index=None):
+        if translation_index is not None:
+            SemanticComparator.use_translations(translation_index)
+        # The old deck is closed once the last reader lets go of it.
+        self._deck = deck
+        DECK_RELOADS.inc()
     
+    def new_cursor(self, scheduler=None):
+        '''
+        Returns a fresh set of next-iterators for every mode. These only keep
+        their own position and read the words from this game, so callers
+        serving several learners can hand each one its own cursor. Every
+        cursor asks due words from its own scheduler (a new one unless
+        given), so every learner has due dates of their own.
+        '''
+        if scheduler is None:
+            scheduler = self._new_scheduler()
+        cursor = {}
+        for k, v in self.SPIEL_MODES.items():
+            kwargs = {"scheduler": scheduler} if k == "due" else {}
+            cursor[k] = {
+                "random": _primed(v(serial=False, **kwargs)),
+                "serial": _primed(v(serial=True, **kwargs))
+            }
+        cursor["due"]["scheduler"] = scheduler
+        return cursor
+
+    def _new_scheduler(self):
+        # New words are introduced in a random order of the scheduler's own.
+        sampler = {"sampler": None}
+        scheduler = SpacedRepetitionScheduler(lambda: self._new_due_word(scheduler, sampler))
+        return scheduler
+
     def sort_words(self, basic_scores):
-        # Calculate the slope of the trend line for each word's scores
-        word_slopes = {}
-        for word, scores in basic_scores.items():
-            x = list(range(1, len(scores) + 1))  # Assuming scores are given in chronological order
-            slope, _ = polyfit(x, scores, 1)
-            word_slopes[word] = slope
-
-        # Sort the words based on their slopes in descending order
-        self._sorted_words = sorted(word_slopes, key=word_slopes.get)
-
-        # Print the sorted words along with their slopes
-        for word in self._sorted_words:
-            logger.debug(f'{word}: {word_slopes[word]}')      
+        # Rank the words by the slope of the trend line of their scores,
+        # assuming scores are given in chronological order.
+        self._ranking = DifficultyRanking.from_histories(basic_scores)
+
+        logger.debug(f"Sorted {len(self._ranking)} words by their score trend.")
                 
     def _prepare_game(self):
         # self.sort_words(self._basic_scores)
         pass
 
     def _get_spiel_word(self, serial):
-        n = len(self._rows)
-        sn = len(self._sorted_words)
-        ideal_interval = math.ceil(sn / n - sn) if sn > n - sn else 1
+        deck = self._deck
+        n = len(deck.rows)
+        # The ranking as this cursor walks it; scores coming in replace it
+        # rather than reorder it under the cursor.
+        sorted_words = self._ranking.words
+        sn = len(sorted_words)
+        ideal_interval = _ideal_interval(n, sn)
         
         interval = random.randint(1, ideal_interval)
         
         logger.debug(f"{n=}, {sn=}, {ideal_interval=}, {interval=}")
         
         index = 0
+        row_index = 0
         asked = 0
         used_words = set()
-        question_indices = set()
+        sampler = PermutationSampler(n)
+        
+        # A position sent into the generator (see get_next_entry) makes the serial
+        # order continue from that row of the deck.
+        position = yield
         
         while True:
+            if self._deck is not deck:
+                # The deck has been reloaded. Carry on after the last word
+                # asked if it is still there, and start a new random round.
+                last_word = deck.rows.word(row_index - 1) if row_index > 0 else None
+                deck = self._deck
+                n = len(deck.rows)
+                row_index = deck.word_positions.get(last_word.lower(), -1) + 1 if last_word else 0
+                sampler = PermutationSampler(n)
+                used_words.clear()
+                ideal_interval = _ideal_interval(n, sn)
+
+            if not serial and self._ranking.words is not sorted_words:
+                # Scored words join and move in the ranking as the game goes
+                # on. Walk the new order from the top, passing over the words
+                # already asked this round.
+                sorted_words = self._ranking.words
+                sn = len(sorted_words)
+                index = 0
+                ideal_interval = _ideal_interval(n, sn)
+
+            if not serial:
+                while index < sn and sorted_words[index] in used_words:
+                    index += 1
+                
             if not serial and (index >= sn or asked >= interval):
                 # I guess the idea was that we serially show the 'sorted words'
                 # or basically the words that are sorted by previous scores
@@ -146,13 +316,20 @@ class DeutschesSpiel:
                 # case, just return a random word index. 
                 
                 logger.debug("Returning a random index word")
-                idx = random.randint(0, n - 1)
-                entry = self._rows[idx]
-                word = entry["word"]
+                epoch = sampler.epoch
+                idx = sampler.draw()
+                if sampler.epoch != epoch:
+                    # Every word has been asked once, so start over.
+                    used_words.clear()
+                    
+                word = deck.rows.word(idx)
                 
                 logger.debug(f"{idx=}, {word=}")
 
-                if word in used_words or idx in question_indices:
+                if word in used_words:
+                    # Already asked as one of the sorted words in this round.
+                    # The sampler never returns it again this epoch, so this
+                    # skips at most once per sorted word.
                     logger.debug(f"Word is already used.")
                     continue
                 
@@ -162,27 +339,32 @@ class DeutschesSpiel:
                     
                 logger.debug(f"{word=}")
 
-                question_indices.add(idx)
-                yield word
+                position = yield word
             else:
+                if position is not None:
+                    # Skip whatever is left of the sorted words and carry on
+                    # from the requested row.
+                    index = max(index, sn)
+                    row_index = position
+                    
                 logger.debug(f"Returning serial order {index} word.")
                 if index < sn:
-                    used_words.add(self._sorted_words[index])
-                    yield self._sorted_words[index]
+                    used_words.add(sorted_words[index])
+                    position = yield sorted_words[index]
                 else:
-                    if index >= n:
-                        index = 0
-                    entry = self._rows[index]
-                    word = entry["word"]
+                    if row_index >= n:
+                        row_index = 0
+                    word = deck.rows.word(row_index)
+                    row_index += 1
                     
                     used_words.add(word)
-                    yield word
+                    position = yield word
                     
                 index += 1
                 asked += 1
                 
     def get_scores(self):
-        return [(w, self._basic_scores[w]) for w in self._sorted_words]
+        return [(w, self._basic_scores[w]) for w in self._ranking.words]
         
     def show_scores(self):
         print("SCORES")
@@ -191,42 +373,123 @@ class DeutschesSpiel:
         for row in sw:
             print(f"{row[0]} -> {row[1]}")
             
+    @metrics.timed()
     def lookup(self, word):
-        word = word.lower()
+        deck = self._deck
         try:
-            return self._spiel_dict[word]
+            return deck.rows[deck.word_positions[word.lower()]]
         except KeyError:
-            return None
+            pass
+
+        # Fall back to the spelling without umlauts and ß, e.g. "Ubung".
+        matches = deck.lookup_index.exact(word)
+        if matches:
+            return deck.rows[deck.word_positions[matches[0].lower()]]
+        return None
+
+    '''
+    Returns up to limit words matching word exactly, as a prefix or within
+    one typo, ignoring case, umlauts and ß.
+    '''
+    @metrics.timed()
+    def suggest(self, word, limit=DEFAULT_SUGGESTIONS):
+        return self._deck.lookup_index.suggest(word, limit)
+
+    '''
+    Returns up to limit example sentences, German or English, containing
+    every word of query, best matches first.
+    '''
+    @metrics.timed()
+    def search(self, query, limit=DEFAULT_RESULTS):
+        return self._deck.search_index.search(query, limit)
         
     '''
     Returns the full list of words.
     '''
     def list(self):
-        return list(self._spiel_dict.keys())
+        return list(self._deck.word_positions.keys())
+
+    '''
+    Returns the capitalized words in sorted order, computed once per deck.
+    The list is shared, so callers must not modify it.
+    '''
+    def sorted_word_list(self):
+        return self._deck.word_list
+
+    '''
+    Identifies the loaded deck; it changes whenever the dump does.
+    '''
+    def deck_version(self):
+        return self._deck.version
     
     
     '''
     Start of next iterator methods.
     '''
     def _get_next_spiel_word(self, serial):
-        next_spiel = self._get_spiel_word(serial)
+        next_spiel = _primed(self._get_spiel_word(serial))
 
+        position = yield
         while True:
-            word = next(next_spiel)
-            yield self._spiel_dict[word.lower()]
+            word = next_spiel.send(position)
+            entry = self.lookup(word)
+            while entry is None:
+                # A ranked word that is gone from a reloaded deck.
+                entry = self.lookup(next(next_spiel))
+            position = yield entry
 
     def _get_next_preposition(self, serial):
         idx = -1
         
+        position = yield
         while True:
+            prepositions = self._deck.prepositions
             if serial:
-                idx += 1
-                if idx >= len(self._prepositions):
+                idx = idx + 1 if position is None else position
+                if idx >= len(prepositions):
                     idx = 0
             else:
-                idx = random.randint(0, len(self._prepositions))
+                idx = random.randrange(len(prepositions))
 
-            yield self._prepositions[idx]
+            position = yield prepositions[idx]
+
+    def _get_next_due_word(self, serial, scheduler=None):
+        # Due words come in the order the scheduler decides, which is shared
+        # by the random and serial orders.
+        if scheduler is None:
+            scheduler = self._scheduler
+        position = yield
+        while True:
+            word = scheduler.next_key()
+            entry = self.lookup(word)
+            # Scheduled words that are gone from a reloaded deck are passed
+            # over, each of them at most once.
+            for _ in range(len(scheduler)):
+                if entry is not None:
+                    break
+                word = scheduler.next_key()
+                entry = self.lookup(word)
+            position = yield entry
+
+    def _new_due_word(self, scheduler, sampler):
+        # Introduces words the scheduler has not seen yet, in random order.
+        deck = self._deck
+        rows = deck.rows
+        n = len(rows)
+        # Rows may repeat a word, so count the distinct words.
+        if len(scheduler) >= len(deck.word_positions):
+            return None
+        
+        if sampler["sampler"] is None or sampler["sampler"].n != n:
+            sampler["sampler"] = PermutationSampler(n)
+        
+        # At most one epoch's worth of draws, in case the words left unseen
+        # are only duplicates of seen ones.
+        for _ in range(n):
+            word = rows.word(sampler["sampler"].draw())
+            if word not in scheduler:
+                return word
+        return None
     '''
     End of next iterator methods.
     '''
@@ -234,7 +497,8 @@ class DeutschesSpiel:
     '''
     Main methods to return next question.
     '''
-    def get_next_entry(self, mode=None, serial=False, start=None):
+    @metrics.timed()
+    def get_next_entry(self, mode=None, serial=False, start=None, cursor=None):
         if start:
             if not serial:
                 raise Exception("Start value provided but order is not serial.")            
@@ -244,49 +508,85 @@ class DeutschesSpiel:
         if mode:
             next_spiel_mode = mode
         elif self._use_multimode:
-            next_spiel_mode = random.choice(list(self.SPIEL_MODES.keys()))
+            next_spiel_mode = random.choice(MULTIMODE_MODES)
         else:           
             raise Exception("No mode provided")
         
         logger.debug(f"Returning question of mode {next_spiel_mode}, serial {serial}, start {start}")
 
+        if cursor is None:
+            cursor = self._mode_handlers
+
         if serial:
-            cnt = 0
-            while True:
-                val = next(self._mode_handlers[next_spiel_mode]["serial"])
-                cnt += 1
-                if start:
-                    # TODO: Clean up this rubbish implementation.
-                    if next_spiel_mode == "word":
-                        if cnt > len(self._rows):
-                            raise Exception(f"Could not find word {start}")
-                        qn = val["word"]
-                    elif next_spiel_mode == "preposition":
-                        if cnt > len(self._prepositions):
-                            raise Exception(f"Could not find preposition {start}")
-                        qn = val["verb"]
-                        
-                    if start.lower() == qn.lower():
-                        break                    
-                    logger.debug(f"Looking for {start} in mode {next_spiel_mode}, reached till {qn}")
-                else:
-                    break            
+            handler = cursor[next_spiel_mode]["serial"]
+            if start:
+                val = handler.send(self._start_position(next_spiel_mode, start))
+            else:
+                val = next(handler)
         else:
-            val = next(self._mode_handlers[next_spiel_mode]["random"])
+            val = next(cursor[next_spiel_mode]["random"])
 
-        return {"mode": next_spiel_mode, "value": val}
+        QUESTIONS_SERVED.inc(mode=next_spiel_mode)
+        return {"mode": QUESTION_TYPES.get(next_spiel_mode, next_spiel_mode), "value": val}
         
+    def _start_position(self, mode, start):
+        if mode == "word":
+            positions = self._deck.word_positions
+        elif mode == "preposition":
+            positions = self._deck.preposition_positions
+        else:
+            raise Exception(f"Start value not supported for mode {mode}")
+
+        try:
+            return positions[start.lower()]
+        except KeyError:
+            raise Exception(f"Could not find {mode} {start}")
+
     def exit_game(self):
-        with open(SCORE_FILE_NAME, 'w') as file:
-            logger.debug(f"Dumping all scores to file.")
-            json.dump(self._basic_scores, file)
+        logger.debug(f"Compacting scores journal into a snapshot.")
+        self._journal.compact(self._score_state())
             
+    @metrics.timed()
     def get_answer_score(self, answer, translation):
-        similarity_score = find_similarity(answer, translation, self._use_semantic)
+        similarity_score = self._similarities([(answer, translation)])[0]
         score = normalized_score(similarity_score, self._use_semantic)
+        ANSWERS_SCORED.inc(result=correctness_string(score))
         return (correctness_string(score), score)
+
+    '''
+    Scores a whole sheet of (answer, translation) pairs in one pass.
+    '''
+    @metrics.timed()
+    def get_answer_scores(self, answers):
+        similarity_scores = self._similarities(answers)
+        ret = []
+        for similarity_score in similarity_scores:
+            score = normalized_score(similarity_score, self._use_semantic)
+            ANSWERS_SCORED.inc(result=correctness_string(score))
+            ret.append((correctness_string(score), score))
+        return ret
     
-    def _log_score(self, key, score):
+    def _similarities(self, pairs):
+        if self._scoring_pool is None:
+            return find_similarities(pairs, self._use_semantic)
+
+        scores = self._scoring_pool.similarities(pairs, self._use_semantic)
+        if scores is not None:
+            return scores
+        # Every worker busy or too slow: fall back to the fuzzy ratio, which
+        # is quick enough to compute here, on the semantic scale.
+        ratios = find_similarities(pairs)
+        return [ratio / 100 for ratio in ratios] if self._use_semantic else ratios
+
+    def _log_score(self, key, score, scheduler=None):
+        now = time.time()
+        self._journal.append({"key": key, "score": score, "time": now})
+        self._apply_score(key, score, now, scheduler)
+
+        if self._journal.needs_compaction():
+            self._journal.compact(self._score_state(), background=True)
+
+    def _apply_score(self, key, score, now, scheduler=None):
         score_delta = 0 if score < 90 else 1
         
         num_rights = 0
@@ -296,8 +596,29 @@ class DeutschesSpiel:
             num_attempts = self._basic_scores[key][1]
             
         self._basic_scores[key] = (num_rights + score_delta, num_attempts + 1)
+
+        # Prepositions are scored too, but only words are ranked and
+        # scheduled.
+        if key.lower() in self._deck.word_positions:
+            self._ranking.update(key, score)
+            (scheduler or self._scheduler).review(key, score_delta == 1, now=now)
+
+    def is_word(self, key):
+        return isinstance(key, str) and key.lower() in self._deck.word_positions
+
+    @metrics.timed()
+    def record_score(self, key, score, cursor=None):
+        # The word is rescheduled for the learner of cursor, if given. Only
+        # words of the deck are kept, so that clients cannot fill the
+        # journal with anything they like.
+        if not self.is_word(key):
+            raise KeyError(key)
+        scheduler = cursor["due"]["scheduler"] if cursor is not None else None
+        self._log_score(key, score, scheduler)
      
     def play_game(self):
+        from colorama import Back, Fore, Style
+
         start = self._start
         mode = self._mode
         
@@ -309,7 +630,7 @@ class DeutschesSpiel:
                     mode = "word"            
                 
                 if not start:
-                    start = self._rows[0]["word"]                
+                    start = self._deck.rows.word(0)                
             else:
                 if not mode:
                     mode = self._basic_scores["last"]["type"]            
@@ -388,6 +709,15 @@ class DeutschesSpiel:
                 self.exit_game()
                 break
 
+def _ideal_interval(n, sn):
+    return math.ceil(sn / max(n - sn, 1)) if sn > n - sn else 1
+
+def _primed(generator):
+    # Advance a next-iterator to its first yield so that it can be sent a
+    # position to jump to straight away.
+    next(generator)
+    return generator
+
 WIDTH = 5
 
 def _print_examples(examples):
@@ -398,8 +728,6 @@ def _print_examples(examples):
         print(f"{i+1}.{'':<{WIDTH-2}}{examples[i][0]}")
         print(f"{'':<{WIDTH}}{examples[i][1]}")
         print()
-            
-from fuzzywuzzy import fuzz
 
 def normalized_score(score, semantic=False):
     if semantic:
@@ -416,42 +744,131 @@ def correctness_string(score):
         return "nicht ganz richtig"
 
 def find_similarity(str1, str2, semantic=False):
+    return find_similarities([(str1, str2)], semantic)[0]
+
+SIMILARITY_CACHE_SIZE = 8192
+_similarity_cache = util.LRUCache(SIMILARITY_CACHE_SIZE)
+
+@metrics.timed()
+def find_similarities(pairs, semantic=False):
     # Convert strings to lowercase for case-insensitive comparison
-    str1_lower = str1.lower()
-    str2_lower = str2.lower()
+    pairs = [(str1.lower(), str2.lower()) for str1, str2 in pairs]
+
+    if semantic:
+        return [SemanticComparator.semantic_similarity(str1, str2) for str1, str2 in pairs]
+
+    # Quizzes keep asking the same words, so most pairs have been scored
+    # before.
+    scores = [_similarity_cache.get(pair) for pair in pairs]
+    missing = [i for i, score in enumerate(scores) if score is None]
+    if missing:
+        ratios = _fuzzy_ratios([pairs[i] for i in missing])
+        for i, ratio in zip(missing, ratios):
+            scores[i] = ratio
+            _similarity_cache.put(pairs[i], ratio)
+
+    return scores
+
+def _fuzzy_ratios(pairs):
+    try:
+        from rapidfuzz import fuzz, process
+    except ImportError:
+        from fuzzywuzzy import fuzz
 
-    if not semantic:
         # Use the fuzz.ratio() method to get a similarity score
-        return fuzz.ratio(str1_lower, str2_lower)
-    else:
-        return SemanticComparator.semantic_similarity(str1_lower, str2_lower)
+        return [fuzz.ratio(str1, str2) for str1, str2 in pairs]
+
+    # rapidfuzz scores all pairs in one call in C. Its ratio is the same
+    # Indel similarity fuzzywuzzy computes with python-Levenshtein, which
+    # fuzzywuzzy rounds to an int.
+    ratios = process.cpdist(
+        [str1 for str1, _ in pairs], [str2 for _, str2 in pairs], scorer=fuzz.ratio)
+    return [int(round(ratio)) for ratio in ratios.tolist()]
 
 THRESHOLD = 80
 def are_strings_similar(str1, str2):
     score = find_similarity(str1, str2)
     return (score >= THRESHOLD, score)
 
-import spacy
+ANSWER_VECTOR_CACHE_SIZE = 4096
+
+SPACY_MODEL = "en_core_web_md"
 
 class SemanticComparator:
     _nlp = None
     
+    # ({<translation>: <row>}, matrix of one unit length row per
+    # translation), replaced as a whole.
+    _translation_index = ({}, None)
+    _answer_vectors = util.LRUCache(ANSWER_VECTOR_CACHE_SIZE)
+    
     @classmethod
-    def load(cls):
+    def load(cls, model=SPACY_MODEL):
+        # spaCy is only imported here since it takes seconds to import and
+        # most games never compare semantically.
+        import spacy
+
         # Load the pre-trained word embeddings model from spaCy
         logger.info("Loading Spacy model..")
-        cls._nlp = spacy.load("en_core_web_md")
+        cls._nlp = spacy.load(model)
+
+    @classmethod
+    def is_loaded(cls):
+        return cls._nlp is not None
+
+    @classmethod
+    def index_translations(cls, translations):
+        cls.use_translations(cls.embed_translations(translations))
+
+    @classmethod
+    def embed_translations(cls, translations):
+        # Embed every translation once, into one matrix. A Doc's vector is
+        # the average of its tokens' static vectors, so only the tokenizer
+        # has to run, not the whole pipeline.
+        import numpy as np
+
+        texts = list(dict.fromkeys(t.lower() for t in translations))
+        vectors = np.zeros((len(texts), cls._nlp.vocab.vectors_length), dtype=np.float32)
+        for row, doc in enumerate(cls._nlp.tokenizer.pipe(texts)):
+            vectors[row] = doc.vector
+
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, norms, out=vectors, where=norms > 0)
+
+        logger.info(f"Embedded {len(texts)} translations.")
+        return {text: row for row, text in enumerate(texts)}, vectors
+
+    @classmethod
+    def use_translations(cls, translation_index):
+        # Takes the result of embed_translations().
+        cls._translation_index = translation_index
+        cls._answer_vectors.clear()
 
     @classmethod
     def semantic_similarity(cls, str1, str2):
-        # Process the strings with spaCy to get their word embeddings
-        doc1 = cls._nlp(str1)
-        doc2 = cls._nlp(str2)
+        import numpy as np
 
-        # Compute the similarity between the two strings based on their word embeddings
-        similarity = doc1.similarity(doc2)
+        # Cosine similarity of the two strings' word embeddings, which is what
+        # Doc.similarity() computes.
+        return float(np.dot(cls._vector(str1), cls._vector(str2)))
 
-        return similarity
+    @classmethod
+    def _vector(cls, text):
+        rows, vectors = cls._translation_index
+        row = rows.get(text)
+        if row is not None:
+            return vectors[row]
+
+        vector = cls._answer_vectors.get(text)
+        if vector is None:
+            import numpy as np
+
+            vector = cls._nlp.make_doc(text).vector
+            norm = np.linalg.norm(vector)
+            if norm > 0:
+                vector = vector / norm
+            cls._answer_vectors.put(text, vector)
+        return vector
 
 def prompt(text):
     user_input = input(f'{text} [j/n] : ').strip().lower()
@@ -470,12 +887,18 @@ if __name__ == "__main__":
     parser.add_argument('--simulate', '-sm', action='store_true', help='Enable simulation mode')
     parser.add_argument('--multi', '-m', action='store_true', help='Enable multi mode')
     parser.add_argument('--serial', '-sl', action='store_true', help='Enable serial mode')
+    parser.add_argument('--profile-startup', action='store_true', help='Report cold import times and exit')
     
     parser.add_argument('-mode', type=str, help='Which mode to use')
     parser.add_argument('-start', type=str, help='Starting word')
 
     args = parser.parse_args()
 
+    if args.profile_startup:
+        from startup_profile import print_import_profile
+        print_import_profile("spiel")
+        exit(0)
+
     if args.debug:
         update_logging_level(logger, "debug")
         logger.info("Enabled debug logging")
@@ -506,6 +929,7 @@ if __name__ == "__main__":
         else:
             exit(f"The environment variable {DEEPL_KEY_VAR} is not set.")
                         
+        from translation_compiler import Compiler
         compiler = Compiler(api_key, simulate)
         compiler.scrape_new(reload=True)
 
@@ -0,0 +1,62 @@
+import os
+import subprocess
+import sys
+
+from log import get_logger
+
+logger = get_logger()
+
+'''
+Reports where a cold import of a module spends its time, using the
+interpreter's own -X importtime output, so that heavy dependencies sneaking
+back into the import path show up before they reach the web workers.
+'''
+def profile_imports(module="spiel"):
+    # Put this directory and its parent on the path, so that both the
+    # top-level modules (spiel) and the package ones (<package>.app) can be
+    # profiled from the directory holding the dump.
+    curr_dir = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [
+        curr_dir, os.path.dirname(curr_dir), env.get("PYTHONPATH")]))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        env=env, capture_output=True, text=True)
+
+    timings = []  # [(<cumulative us>, <self us>, <module>)]
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        try:
+            self_us = int(parts[0])
+            cumulative_us = int(parts[1])
+        except ValueError:
+            continue  # The header line.
+        timings.append((cumulative_us, self_us, parts[2].rstrip()))
+
+    if result.returncode != 0:
+        logger.error(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+
+    return timings
+
+def print_import_profile(module="spiel", top=20):
+    timings = profile_imports(module)
+    # The cumulative time of the module itself covers the whole import.
+    total = max((t[0] for t in timings if t[2].strip() == module), default=0)
+
+    print(f"Cold import of {module}: {total / 1000:.1f} ms")
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for cumulative_us, self_us, name in sorted(timings, reverse=True)[:top]:
+        print(f"{cumulative_us / 1000:>14.1f} {self_us / 1000:>9.1f}  {name}")
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Profile the cold import of a module")
+    parser.add_argument('module', nargs='?', default="spiel", help='Module to import, e.g. spiel or <package>.app')
+    parser.add_argument('--top', type=int, default=20, help='Number of slowest imports to show')
+
+    args = parser.parse_args()
+    print_import_profile(args.module, args.top)
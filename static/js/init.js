@@ -10,6 +10,8 @@ function initWithLastInformation() {
         queryParams += "&question_type=" + question_type;
         queryParams += "&start=" + start_key;
         sessionInit('/next_question?' + queryParams);
+    } else if (order && order == "due") {
+        sessionInit('/next_question?order=due');
     } else {
         sessionInit('/next_question?');
     }
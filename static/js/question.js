@@ -108,14 +108,74 @@ function handleExitLinkClick() {
     saveDataToLocalStorage();
 }
 
-function callNextLinkWithPossibleInit(nextUrl, sessionId) {
+/*********** Things to do with the question queue ********/
+// Questions are fetched from /next_questions in batches and asked from this
+// queue, so that only every BATCH_SIZE-th question waits for the server.
+const BATCH_SIZE = 10;
+// Fetch the next batch in the background once this few are left.
+const PREFETCH_AT = 2;
+
+let currentEntry = null;
+let questionQueue = [];
+let queueOrder = null;
+let fetchingQuestions = false;
+
+function nextQuestionsUrl(order) {
+    let url = "/next_questions?n=" + BATCH_SIZE;
+    if (order == "serial") {
+        let nextType = undefined;
+        let unasked = localStorage.getItem("unasked");
+        if (unasked) {
+            unasked = new Set(JSON.parse(unasked));
+            if (unasked.size > 0) {
+                nextType = unasked.values().next().value;
+            }
+        }
+
+        let nextKey = undefined;
+        let last = localStorage.getItem('last');
+        if (last && nextType) {
+            last = JSON.parse(last);
+
+            let typeAttr = "key_" + nextType;
+            if (typeAttr in last) {
+                nextKey = last[typeAttr];
+            }
+        }
+
+        url += "&order=serial";
+        if (nextType != undefined && nextKey != undefined) {
+            url += "&start=" + encodeURIComponent(nextKey) + "&question_type=" + nextType;
+        }
+    } else if (order == "due") {
+        url += "&order=due";
+    }
+    return url;
+}
+
+function fetchQuestions(order, onFetched) {
+    if (fetchingQuestions) {
+        return;
+    }
+    fetchingQuestions = true;
+
+    const sessionId = document.getElementById("session_id").value
     $.ajax({
-        url: nextUrl + "&session_id=" + sessionId,
+        url: nextQuestionsUrl(order) + "&session_id=" + sessionId,
         method: 'GET',
         success: function(response, textStatus, jqXHR) {
-            window.location.href = nextUrl + "&session_id=" + sessionId;
+            fetchingQuestions = false;
+            if (queueOrder != order) {
+                // The order was changed while this batch was on its way.
+                return;
+            }
+            questionQueue = questionQueue.concat(response.next_questions);
+            if (onFetched) {
+                onFetched();
+            }
         },
         error: function(jqXHR, textStatus, errorThrown) {
+            fetchingQuestions = false;
             if (jqXHR.status === 408) {
                 // Handle 408 error by navigating to the fallback URL
                 // We need to re-init here to get the new session ID (thereby)
@@ -126,10 +186,115 @@ function callNextLinkWithPossibleInit(nextUrl, sessionId) {
                 console.error('Request failed:', textStatus, errorThrown);
             }
         }
-    });    
+    });
+}
+
+function showNextQuestion(order) {
+    if (queueOrder != order) {
+        questionQueue = [];
+        queueOrder = order;
+    }
+
+    if (questionQueue.length == 0) {
+        fetchQuestions(order, function() {
+            showNextQuestion(order);
+        });
+        return;
+    }
+
+    renderQuestion(questionQueue.shift());
+    if (questionQueue.length <= PREFETCH_AT) {
+        fetchQuestions(order);
+    }
+}
+
+function paragraph(before, highlighted, after) {
+    const p = document.createElement("p");
+    const span = document.createElement("span");
+    span.className = "highlight";
+    span.textContent = highlighted;
+    p.append(before, span, after);
+    return p;
+}
+
+function answerInput(id) {
+    const input = document.createElement("input");
+    input.type = "text";
+    input.id = id;
+    input.placeholder = "Deine Antwort...";
+    return input;
+}
+
+function renderQuestion(entry) {
+    currentEntry = entry;
+
+    const question = document.getElementById("question");
+    const examples = document.getElementById("examples");
+    const synonyms = document.getElementById("synonyms");
+    question.replaceChildren();
+    examples.replaceChildren();
+    synonyms.style.display = 'none';
+
+    let key = "";
+    let answer = "";
+    if (entry.mode == "word") {
+        key = "word;" + entry.word;
+        answer = entry.translation;
+
+        if (entry.de_to_en) {
+            question.append(paragraph("Was bedeutet ", entry.word, "?"));
+        } else {
+            question.append(paragraph("Was ist das Deutche Wort für ", entry.word, "?"));
+        }
+        question.append(answerInput("answer"));
+
+        if (entry.synonyms != '') {
+            synonyms.textContent = "Synonyme: " + entry.synonyms;
+            synonyms.style.display = 'block';
+        }
+
+        for (const item of entry.examples) {
+            const div = document.createElement("div");
+            div.className = "item";
+            const german = document.createElement("div");
+            german.textContent = item[0];
+            const english = document.createElement("div");
+            english.className = "italic";
+            english.textContent = item[1];
+            div.append(german, english);
+            examples.append(div);
+        }
+    } else if (entry.mode == "preposition") {
+        key = "preposition;" + entry.verb;
+        answer = entry.verb + ' ' + entry.preposition + ' ' + entry.akk_dat + ' ::: ' + entry.bedeutung;
+
+        question.append(paragraph("Welche Präposition soll mit ", entry.verb, " verwendet werden?"));
+        question.append(answerInput("answer_preposition"));
+        const akkdat = document.createElement("p");
+        akkdat.textContent = "Und nutzt man Akkusativ oder Dativ?";
+        question.append(akkdat, answerInput("answer_akkdat"));
+    }
+
+    document.getElementById("question_key").value = key;
+    document.getElementById("real_answer").textContent = answer;
+    document.getElementById("scorePara").textContent = "";
+    document.getElementById("lookup_link").href = "/lookup?wort=" + encodeURIComponent(entry.word || "");
+
+    document.getElementById('result').style.display = 'none';
+    document.getElementById('toplinks').style.display = 'none';
+    document.getElementById('quizForm').style.display = 'block';
+    const firstInput = question.querySelector("input");
+    if (firstInput) {
+        firstInput.focus();
+    }
+
+    saveLastQuestionData(key);
 }
+/*********** Things to do with the question queue ********/
+
+function handleNextLinkClick(event) {
+    event.preventDefault();
 
-function handleNextLinkClick() {
     const radios = document.getElementsByName('order');
     let selectedValue;
     for (const radio of radios) {
@@ -141,49 +306,13 @@ function handleNextLinkClick() {
     
     if (selectedValue != undefined && selectedValue == "serial") {
         localStorage.setItem('order', "serial");
-
-        let nextType = undefined;
-        let unasked = localStorage.getItem("unasked");
-        if (unasked) {
-            unasked = new Set(JSON.parse(unasked));
-            if (unasked.size > 0) {
-                nextType = unasked.values().next().value;
-            }
-        }
-
-        let nextKey = undefined;
-        let last = localStorage.getItem('last');
-        if (last && nextType) {
-            last = JSON.parse(last);
-
-            let typeAttr = "key_" + nextType;
-            if (typeAttr in last) {
-                nextKey = last[typeAttr];
-            }
-        }
-
-        let redirectUrl = undefined;
-        if (nextType != undefined && nextKey != undefined) {
-            redirectUrl = "/next_question?order=serial&start="+nextKey+"&question_type="+nextType;
-        } else {
-            redirectUrl = "/next_question?order=serial";
-        }
-        
-        const sessionId = document.getElementById("session_id").value
-        // window.location.href = redirectUrl + "&session_id=" + sessionId;
-        callNextLinkWithPossibleInit(redirectUrl, sessionId);
-
-        // let last = localStorage.getItem('last');
-        // if (last != undefined) {
-        //     let question_type = last.split(';')[0];
-        //     let key = last.split(';')[1];
-        //     window.location.href = "/next_question?order=serial&start="+key+"&question_type="+question_type;    
-        // } else {
-        //     window.location.href = "/next_question?order=serial";
-        // }
+        showNextQuestion("serial");
+    } else if (selectedValue != undefined && selectedValue == "due") {
+        localStorage.setItem('order', "due");
+        showNextQuestion("due");
     } else {
         localStorage.setItem('order', "random");
-        redirectUrl = "/next_question";
+        showNextQuestion("random");
     }
 }
 
@@ -5,15 +5,10 @@ import gevent
 from functools import partial
 import json
 import os
-import threading
 import traceback
 
-import gspread
-
+from deck import compile_deck, load_deck
 from log import get_logger
-from scraper.crawler import CrawlerFactory
-from scraper.parser import ParserFactory
-from scraper.translator import TranslatorFactory
 import util
 
 DUMP_FILE_NAME =  "_dump.txt"
@@ -22,10 +17,26 @@ INCORRECT_WORDS_FILE_NAME = "_to_be_fixed.txt"
 
 DEEPL_KEY_VAR = "DEEPL_KEY"
 
+# Hosts the crawl scheduler rate limits the crawler and translator by.
+DWDS_HOST = "www.dwds.de"
+DEEPL_HOST = "api.deepl.com"
+
+# Seconds to wait for the translations of a word's examples, and for any
+# crawl or translation at all to complete before giving up on the rest.
+EXAMPLES_TIMEOUT = 600
+STALL_TIMEOUT = 600
+
 logger = get_logger()
 
 class Compiler:
     def __init__(self, translator_api_key, simulation=False):
+        # The scrapers pull in requests and DeepL, which the
+        # game only needs when it has to compile a dump.
+        from scraper.crawl_scheduler import CrawlScheduler, DEFAULT_CRAWL_CONCURRENCY
+        from scraper.crawler import CrawlerFactory
+        from scraper.parser import ParserFactory
+        from scraper.translator import TranslatorFactory
+
         logger.info("Starting Compiler...")
         
         self._worksheet = None
@@ -33,7 +44,8 @@ class Compiler:
         self._entries = None
         self._gs_entries = None
         
-        self._crawler = CrawlerFactory.get_crawler("dwds")
+        # One pooled connection per crawl the scheduler runs at once.
+        self._crawler = CrawlerFactory.get_crawler("dwds", pool_size=DEFAULT_CRAWL_CONCURRENCY)
         
         self._simulation = simulation
         if self._simulation:
@@ -42,6 +54,10 @@ class Compiler:
             self._translator = TranslatorFactory.get_translator("deepl", translator_api_key)
 
         self._parser = ParserFactory.get_parser("dwds")
+
+        # Every request to DWDS and DeepL goes through the scheduler, which
+        # bounds how many run at once and how fast each host is hit.
+        self._scheduler = CrawlScheduler()
                       
     def scrape_new(self, reload=False):
         # Step 1. Read word list.
@@ -80,14 +96,12 @@ class Compiler:
         if "translation" in scrape_entry and "file" in scrape_entry:
             logger.debug(f"Both keys set for {scrape_word}")
         
-            t = threading.Thread(
-                target=self._combine_scrape_data,
-                name=scrape_word,
-                args=(scrape_word, scrape_entry,))
-            t.start()
-            t.join()
-            
-            event.set()
+            # Links run in greenlets of their own on the main hub, which the
+            # scheduler's greenlets belong to, so this may wait for them.
+            try:
+                self._combine_scrape_data(scrape_word, scrape_entry)
+            finally:
+                event.set()
         
     def _combine_scrape_data(self, scrape_word, scrape_entry):
         scrape_entry["examples"] = []
@@ -109,16 +123,18 @@ class Compiler:
 
         examples = self._parser.parse_examples(scrape_contents)
         
-        # Invoke greenlets to fetch the translations of the examples.
+        # Invoke greenlets to fetch the translations of the examples. They
+        # may have to wait for their turn with DeepL, hence the long timeout;
+        # examples still untranslated then are kept without a translation.
         greenlets = []
         idx = 0
         for eg in examples:
-            g = gevent.spawn(self._translate_de_to_en, eg)
+            g = self._scheduler.translate(DEEPL_HOST, self._translate_de_to_en, eg)
             g.name = str(idx)
             greenlets.append(g)
             idx += 1
             
-        greenlets = gevent.joinall(greenlets, timeout=10)
+        gevent.joinall(greenlets, timeout=EXAMPLES_TIMEOUT)
         
         compiled_examples = []
         for g in greenlets:
@@ -139,19 +155,21 @@ class Compiler:
             return
 
         events = []
+        en_to_de_translations = []  # [(<scrape entry>, <greenlet>)]
         for scrape_word, scrape_entry in to_be_scraped_queue.items():
             if scrape_entry['de_to_en']:
                 event = gevent.event.Event()
                 events.append(event)
                 
-                greenlet1 = gevent.spawn(self._scrape_de_to_en, scrape_word)
+                greenlet1 = self._scheduler.crawl(DWDS_HOST, self._scrape_de_to_en, scrape_word)
                 greenlet1.name = "file"
                 greenlet1.link(partial(
                     self._post_process_scrape, 
                     scrape_word, scrape_entry, event))
                 
                 if "translation" not in scrape_entry:                
-                    greenlet2 = gevent.spawn(self._translate_de_to_en, scrape_word)
+                    greenlet2 = self._scheduler.translate(
+                        DEEPL_HOST, self._translate_de_to_en, scrape_word)
                     greenlet2.name = "translation"
 
                     greenlet2.link(partial(
@@ -160,9 +178,10 @@ class Compiler:
             else:  # en to de
                 # First get the German translation, then do the usual scraping
                 # as is done for German words.
-                if "translation" not in scrape_entry:                            
-                    translation = self._translate_en_to_de(scrape_word)
-                    scrape_entry["translation"] = translation
+                if "translation" not in scrape_entry:
+                    greenlet = self._scheduler.translate(
+                        DEEPL_HOST, self._translate_en_to_de, scrape_word)
+                    en_to_de_translations.append((scrape_entry, greenlet))
 
                 # event = gevent.event.Event()
                 # events.append(event)
@@ -173,12 +192,28 @@ class Compiler:
                 #     translation, scrape_entry, event))
                 
                           
-        gevent.wait(events)
+        self._wait_for_scrapes(events)
+        for scrape_entry, greenlet in en_to_de_translations:
+            scrape_entry["translation"] = greenlet.value
         
+        self._crawler.log_crawl_stats()
         self._translator.get_translator_call_stats()
         self._dump_metadata(to_be_scraped_queue)
         self._write_translations_to_gs(to_be_scraped_queue)
                 
+    def _wait_for_scrapes(self, events):
+        # Waits for as long as calls keep completing, so that a lost greenlet
+        # cannot hold up the compile forever.
+        while True:
+            completed = self._scheduler.completed()
+            ready = gevent.wait(events, timeout=STALL_TIMEOUT)
+            if len(ready) == len(events) and self._scheduler.join(timeout=STALL_TIMEOUT):
+                return
+            if self._scheduler.completed() == completed:
+                logger.error(f"No scrape or translation completed in {STALL_TIMEOUT}s, "
+                             f"{len(events) - len(ready)} words left unfinished.")
+                return
+
     def _dump_metadata(self, scraped_entries):
         dump_entries = []
         incorrect_words = []
@@ -203,6 +238,7 @@ class Compiler:
         
         if not self._simulation:    
             util.append_to_file(DUMP_FILE_NAME, dump_entries)
+            compile_deck(DUMP_FILE_NAME)
             
         if not len(incorrect_words) > 0:
             util.append_to_file(INCORRECT_WORDS_FILE_NAME, incorrect_words)
@@ -268,16 +304,16 @@ class Compiler:
         try:
             # First try to read from a local dump file. Re-read if file is not
             # available or if the file is older than current date.        
-            with open(DUMP_FILE_NAME, 'r') as file:                
-                logger.debug(f"Loading entries from current dump file.")
-                self._entries = json.load(file)
-                return True
-        except (FileNotFoundError, json.JSONDecodeError) as e:
+            self._entries = load_deck(DUMP_FILE_NAME)
+            return True
+        except (FileNotFoundError, ValueError) as e:
             logger.warning(f"Could not read dump file {DUMP_FILE_NAME} due to: {e}")
         
         return False
         
     def _fetch_from_gsheet(self):
+        import gspread
+
         try:
             logger.info(f"Reading Google Spreadsheet file")
             
@@ -305,6 +341,8 @@ class Compiler:
             return False
         
     def _write_translations_to_gs(self, scraped_entries):
+        import gspread
+
         if self._worksheet is None:
             logger.critical("Worksheet is not set, this is unexpected.")
 
@@ -1,4 +1,6 @@
+from collections import OrderedDict
 import json
+import time
 
 def file_exists(file_name):
     try:
@@ -21,4 +23,86 @@ def append_to_file(file_name, new_entries):
 
     # Write the updated list back to the file
     with open(file_name, 'w') as file:
-        json.dump(existing_data, file)
\ No newline at end of file
+        json.dump(existing_data, file)
+
+class LRUCache:
+    '''
+    Bounded mapping that drops the least recently used entries once the total
+    weight of its values exceeds max_weight. By default every value weighs 1,
+    so max_weight is simply the number of entries kept. Entries older than ttl
+    seconds (if given) are dropped as well.
+    '''
+    def __init__(self, max_weight, ttl=None, weigh=None):
+        self._max_weight = max_weight
+        self._ttl = ttl
+        self._weigh = weigh if weigh is not None else (lambda value: 1)
+
+        self._entries = OrderedDict()  # {<key>: (<value>, <weight>, <expiry>)}
+        self._weight = 0
+
+    def get(self, key, default=None):
+        try:
+            value, _, expiry = self._entries[key]
+        except KeyError:
+            return default
+
+        if expiry is not None and expiry <= time.monotonic():
+            self._remove(key)
+            return default
+
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        if key in self._entries:
+            self._remove(key)
+
+        weight = self._weigh(value)
+        if weight > self._max_weight:
+            return
+
+        expiry = time.monotonic() + self._ttl if self._ttl is not None else None
+        self._entries[key] = (value, weight, expiry)
+        self._weight += weight
+
+        self._evict()
+
+    def pop(self, key, default=None):
+        if key not in self._entries:
+            return default
+        value = self._entries[key][0]
+        self._remove(key)
+        return value
+
+    def clear(self):
+        self._entries.clear()
+        self._weight = 0
+
+    def weight(self):
+        return self._weight
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        entry = self._entries.get(key)
+        return entry is not None and (
+            entry[2] is None or entry[2] > time.monotonic())
+
+    def _remove(self, key):
+        _, weight, _ = self._entries.pop(key)
+        self._weight -= weight
+
+    def _evict(self):
+        now = time.monotonic()
+
+        # Entries are in least recently used order, so expired ones are not
+        # necessarily at the front; only the ones that are get dropped here,
+        # the rest are dropped lazily in get().
+        while self._entries:
+            key, (_, _, expiry) = next(iter(self._entries.items()))
+            if self._weight > self._max_weight or (
+                    expiry is not None and expiry <= now):
+                self._remove(key)
+            else:
+                break